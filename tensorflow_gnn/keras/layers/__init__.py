@@ -41,8 +41,12 @@ SimpleConv = convolutions.SimpleConv
 ItemDropout = item_dropout.ItemDropout
 
 NextStateFromConcat = next_state.NextStateFromConcat
+NextStateFromSum = next_state.NextStateFromSum
 ResidualNextState = next_state.ResidualNextState
 SingleInputNextState = next_state.SingleInputNextState
+CompiledNextState = next_state.CompiledNextState
+compile_next_state = next_state.compile_next_state
+export_next_state = next_state.export_next_state
 
 EdgeSetUpdate = graph_update.EdgeSetUpdate
 NodeSetUpdate = graph_update.NodeSetUpdate
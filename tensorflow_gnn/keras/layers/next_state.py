@@ -93,7 +93,10 @@ for the benefit of human readers, but pytype cannot actually check the
 interface requirements beyond being any Keras layer.
 """
 
-from typing import Any, Optional, Tuple
+import collections
+import functools
+import operator
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
 
 import tensorflow as tf
 
@@ -107,6 +110,254 @@ NextStateForContext = tf.keras.layers.Layer
 NextState = tf.keras.layers.Layer
 
 
+def _concat_shape(structure: Any) -> Optional[tf.TensorShape]:
+  """Returns the shape of concatenating the leaf shapes on the last axis.
+
+  Args:
+    structure: A nest of `tf.TensorShape`s, as passed to `Layer.build()`.
+
+  Returns:
+    The shape of the concatenation, or None if it cannot be determined
+    statically.
+  """
+  shapes = tf.nest.flatten(structure)
+  if not shapes or any(not isinstance(s, tf.TensorShape) or not s.rank
+                       for s in shapes):
+    return None
+  last_dims = [s[-1] for s in shapes]
+  if any(d is None for d in last_dims):
+    return None
+  return shapes[0][:-1].concatenate([sum(last_dims)])
+
+
+def _concat_features(flat_inputs: List[Any]) -> Any:
+  """Returns `tf.concat(flat_inputs, axis=-1)`.
+
+  Dense tensors are concatenated by the raw op, which skips the argument
+  handling of the `tf.concat()` wrapper.
+
+  RaggedTensors whose last dimension is uniform are concatenated on their
+  flat values and rewrapped with the row partitions of the first input.
+  This relies on all inputs being shaped like the features of the same
+  graph piece, which holds for the inputs of a NextState layer.
+
+  Args:
+    flat_inputs: A non-empty list of tensors.
+  """
+  if all(isinstance(x, tf.RaggedTensor) for x in flat_inputs):
+    ragged_rank = flat_inputs[0].ragged_rank
+    if all(x.ragged_rank == ragged_rank and x.flat_values.shape.rank >= 2
+           for x in flat_inputs):
+      return flat_inputs[0].with_flat_values(
+          _concat_features([x.flat_values for x in flat_inputs]))
+  if not all(isinstance(x, tf.Tensor) for x in flat_inputs):
+    return tf.concat(flat_inputs, axis=-1)  # Dispatches for RaggedTensors.
+  if len(flat_inputs) == 1:
+    return flat_inputs[0]
+  return tf.raw_ops.ConcatV2(values=flat_inputs, axis=-1)
+
+
+def _can_split_dense(dense: tf.keras.layers.Dense,
+                     flat_inputs: List[Any]) -> bool:
+  """Returns true if `_split_dense()` supports these arguments."""
+  if not dense.built or dense.activity_regularizer is not None:
+    return False
+  return all(isinstance(x, tf.Tensor) and x.shape.rank == 2
+             and x.shape[-1] is not None for x in flat_inputs)
+
+
+def _split_dense(dense: tf.keras.layers.Dense,
+                 flat_inputs: List[tf.Tensor]) -> tf.Tensor:
+  """Returns `dense(tf.concat(flat_inputs, axis=-1))` without the concat.
+
+  The concatenated inputs times the kernel equal the sum of the products of
+  each input with the matching row slice of the kernel. This avoids
+  materializing the concatenated inputs.
+
+  Args:
+    dense: A built Dense layer without activity regularizer.
+    flat_inputs: A non-empty list of rank-2 dense tensors whose last dimensions
+      add up to the input dimension of `dense`.
+  """
+  dtype = flat_inputs[0].dtype
+  kernel = tf.cast(dense.kernel, dtype)
+  kernels = tf.split(kernel, [x.shape[-1] for x in flat_inputs], axis=0)
+  net = tf.math.add_n([tf.matmul(x, w) for x, w in zip(flat_inputs, kernels)])
+  if dense.use_bias:
+    net = tf.nn.bias_add(net, tf.cast(dense.bias, dtype))
+  if dense.activation is not None:
+    net = dense.activation(net)
+  return net
+
+
+def _dense_with_broadcast_inputs(dense: tf.keras.layers.Dense,
+                                 flat_inputs: List[tf.Tensor],
+                                 flat_broadcast_inputs: List[tf.Tensor],
+                                 split_kernel: bool) -> tf.Tensor:
+  """Returns `dense(tf.concat(flat_inputs + flat_broadcast_inputs, -1))`.
+
+  The broadcast inputs must have the same value in each row. Their product
+  with the matching row slice of the kernel is computed only for their
+  first row and gets added to the bias, so that they need not be
+  concatenated with the other inputs.
+
+  Args:
+    dense: A built Dense layer without activity regularizer.
+    flat_inputs: A non-empty list of rank-2 dense tensors.
+    flat_broadcast_inputs: A non-empty list of rank-2 dense tensors with
+      the same number of rows as `flat_inputs` and all rows equal.
+    split_kernel: If true, `flat_inputs` are multiplied with row slices of
+      the kernel instead of being concatenated, as in `_split_dense()`.
+  """
+  dtype = flat_inputs[0].dtype
+  kernel = tf.cast(dense.kernel, dtype)
+  widths = [x.shape[-1] for x in flat_inputs]
+  broadcast_widths = [x.shape[-1] for x in flat_broadcast_inputs]
+  kernel, broadcast_kernel = tf.split(
+      kernel, [sum(widths), sum(broadcast_widths)], axis=0)
+  broadcast_kernels = tf.split(broadcast_kernel, broadcast_widths, axis=0)
+  bias = tf.math.add_n([tf.matmul(x[:1], w) for x, w
+                        in zip(flat_broadcast_inputs, broadcast_kernels)])
+  if dense.use_bias:
+    bias = tf.nn.bias_add(bias, tf.cast(dense.bias, dtype))
+  if split_kernel:
+    kernels = tf.split(kernel, widths, axis=0)
+    net = tf.math.add_n([tf.matmul(x, w)
+                         for x, w in zip(flat_inputs, kernels)])
+  else:
+    net = tf.matmul(_concat_features(flat_inputs), kernel)
+  net = tf.add(net, bias)
+  if dense.activation is not None:
+    net = dense.activation(net)
+  return net
+
+
+def _split_final_dense(
+    layer: tf.keras.layers.Layer
+) -> Optional[Tuple[List[tf.keras.layers.Layer], tf.keras.layers.Dense]]:
+  """Splits off a final linear Dense layer with bias from `layer`.
+
+  Args:
+    layer: A Keras layer, possibly a `tf.keras.Sequential` model.
+
+  Returns:
+    A pair `(head, dense)` such that calling the layers in `head` followed
+    by `dense` is equivalent to calling `layer`, if `layer` is built and
+    `dense` is a Dense layer with a bias, no activation and no activity
+    regularizer. Otherwise None.
+  """
+  if not layer.built:
+    return None
+  if isinstance(layer, tf.keras.Sequential):
+    if not layer.layers:
+      return None
+    head, dense = layer.layers[:-1], layer.layers[-1]
+  else:
+    head, dense = [], layer
+  if (not isinstance(dense, tf.keras.layers.Dense)
+      or not dense.use_bias
+      or dense.activation not in (None, tf.keras.activations.linear)
+      or dense.activity_regularizer is not None):
+    return None
+  return head, dense
+
+
+def _dense_without_bias(
+    dense: tf.keras.layers.Dense,
+    net: Any) -> Tuple[tf.Tensor, Optional[tf.Tensor]]:
+  """Returns `(x, bias)` such that `tf.nn.bias_add(x, bias) == dense(net)`.
+
+  If `net` is not a dense matrix, this returns `(dense(net), None)` instead.
+
+  Args:
+    dense: A built Dense layer with bias but no activation, as returned by
+      `_split_final_dense()`.
+    net: The input to `dense`.
+  """
+  if not (isinstance(net, tf.Tensor) and net.shape.rank == 2):
+    return dense(net), None
+  dtype = dense.compute_dtype
+  net = tf.matmul(tf.cast(net, dtype), tf.cast(dense.kernel, dtype))
+  return net, tf.cast(dense.bias, dtype)
+
+
+def _relaxed_tensor_spec(tensor: tf.Tensor) -> tf.TensorSpec:
+  """Returns the TensorSpec of `tensor` with an unknown outermost dimension."""
+  shape = tensor.shape
+  if shape.rank:
+    shape = tf.TensorShape([None]).concatenate(shape[1:])
+  return tf.TensorSpec(shape, tensor.dtype)
+
+
+class _ConcreteFunctionCache:
+  """Caches the concrete functions of a tf.function for lists of tensors.
+
+  Each concrete function is called with arguments of the same structure as
+  it was traced for, so that they bind to its structured signature directly.
+  This is a plain Python object, so Keras does not track the functions
+  for saving.
+  """
+
+  def __init__(self, function: Callable[..., Any]):
+    self._function = function
+    self._concrete_fns = {}
+
+  def call(self, *tensor_lists: List[tf.Tensor], **kwargs) -> Any:
+    """Returns `function(*tensor_lists, **kwargs)` from a concrete function."""
+    specs = tuple(tuple(_relaxed_tensor_spec(x) for x in tensor_list)
+                  for tensor_list in tensor_lists)
+    key = (specs, tuple(sorted(kwargs.items())))
+    concrete_fn = self._concrete_fns.get(key)
+    if concrete_fn is None:
+      concrete_fn = self._concrete_fns[key] = (
+          self._function.get_concrete_function(
+              *[list(s) for s in specs], **kwargs))
+    return concrete_fn(*tensor_lists, **kwargs)
+
+
+def _flat_signature(input_signature: Any,
+                    dtype: tf.DType) -> List[tf.TypeSpec]:
+  """Flattens `input_signature`, with floating-point TensorSpecs in `dtype`.
+
+  Keras casts floating-point inputs to the compute dtype of a layer before
+  calling it, so this is what the layer's call implementation receives.
+
+  Args:
+    input_signature: A nest of `tf.TypeSpec`s.
+    dtype: The compute dtype of the layer.
+  """
+  return [tf.TensorSpec(spec.shape, dtype, spec.name)
+          if isinstance(spec, tf.TensorSpec) and spec.dtype.is_floating
+          else spec
+          for spec in tf.nest.flatten(input_signature)]
+
+
+class _FixedSignatureFunctions:
+  """Holds tf.functions with a fixed input signature, one per `training`.
+
+  This is a plain Python object, so Keras does not track the functions
+  for saving.
+  """
+
+  def __init__(self,
+               python_function: Callable[..., Any],
+               input_signature: List[Any],
+               jit_compile: bool):
+    self._python_function = python_function
+    self._input_signature = input_signature
+    self._jit_compile = jit_compile
+    self._functions = {}
+
+  def call(self, *args, training: Optional[bool]) -> Any:
+    function = self._functions.get(training)
+    if function is None:
+      function = self._functions[training] = tf.function(
+          functools.partial(self._python_function, training=training),
+          input_signature=self._input_signature,
+          jit_compile=self._jit_compile or None)
+    return function(*args)
+
+
 @tf.keras.utils.register_keras_serializable(package="GNN")
 class NextStateFromConcat(tf.keras.layers.Layer):
   """Computes a new state by concatenating inputs and applying a Keras Layer.
@@ -114,12 +365,181 @@ class NextStateFromConcat(tf.keras.layers.Layer):
   This layer flattens all inputs into a list (forgetting their origin),
   concatenates them and sends them through a user-supplied feed-forward network.
 
+  This layer supports mixed precision. For example, after calling
+  `tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")`, floating-point
+  inputs are cast to bfloat16 before the concatenation, and the transformation
+  runs in bfloat16 (with float32 variables), unless configured otherwise.
+
   This layer can be restored from config by `tf.keras.models.load_model()`
   when saved as part of a Keras model using `save_format="tf"`.
 
   Init args:
     transformation: Required. A Keras Layer to transform the combined inputs
       into the new state.
+    jit_compile: If true, the concatenation and the transformation are
+      compiled with XLA (as by `tf.function(jit_compile=True)`), which allows
+      to fuse them into fewer kernels. Defaults to false, because not all
+      platforms, input types and transformations support XLA.
+    split_dense_kernel: If true, `transformation` must be a
+      `tf.keras.layers.Dense` layer. Instead of concatenating the inputs and
+      calling it, its kernel is split into row slices that get multiplied
+      with each input separately, and the products are summed up, followed by
+      the Dense layer's bias and activation. This avoids materializing the
+      concatenated inputs, which is typically the largest intermediate
+      result. Inputs other than dense tensors of rank 2 with a known last
+      dimension, or a Dense layer with an activity regularizer, fall back to
+      the concatenation. Defaults to false.
+    context_is_broadcast: If true, `transformation` must be a
+      `tf.keras.layers.Dense` layer, and the third input (e.g., the context
+      state broadcast to each node or edge) must have the same value in each
+      row. The product of the third input with its row slice of the kernel is
+      then computed for the first row only and added to the bias, so it is
+      neither concatenated with the other inputs nor multiplied row by row.
+      This is only correct if all rows of the third input are equal, e.g.,
+      if each input graph has a single component and its context state is
+      broadcast, but not after merging a batch of graphs into components of
+      one graph. The inputs need to satisfy the same conditions as for
+      `split_dense_kernel`, otherwise all inputs are concatenated as usual.
+      Defaults to false.
+    use_concrete_function: If true, calls with dense tensors as inputs and
+      a Python boolean (or None) for `training` are computed by calling a
+      concrete function, traced once for each combination of input dtypes,
+      shapes (up to the outermost dimension) and `training`. This replaces
+      op-by-op execution in eager mode by a single graph execution.
+      Defaults to false.
+    input_signature: Optionally, a nest of `tf.TensorSpec`s like the inputs
+      (with None for dimensions that vary, usually the outermost one). If set,
+      the computation (after flattening the inputs) is a `tf.function` with
+      this input signature, so it gets traced (and compiled, if `jit_compile`
+      is set) only once for each value of `training`, and inputs that do not
+      match the signature raise an error. Floating-point dtypes are replaced
+      by the layer's compute dtype, to match Keras' autocasting of inputs.
+
+  Call returns:
+    The result of transformation.
+  """
+
+  def __init__(self,
+               transformation: tf.keras.layers.Layer,
+               *,
+               jit_compile: bool = False,
+               split_dense_kernel: bool = False,
+               context_is_broadcast: bool = False,
+               use_concrete_function: bool = False,
+               input_signature: Optional[Any] = None,
+               **kwargs):
+    super().__init__(**kwargs)
+    for arg_name, arg_value in [("split_dense_kernel", split_dense_kernel),
+                                ("context_is_broadcast", context_is_broadcast)]:
+      if arg_value and not isinstance(transformation, tf.keras.layers.Dense):
+        raise ValueError(
+            f"NextStateFromConcat({arg_name}=True) requires a "
+            f"tf.keras.layers.Dense as transformation, got {transformation}")
+    self._transformation = transformation
+    self._jit_compile = jit_compile
+    self._split_dense_kernel = split_dense_kernel
+    self._context_is_broadcast = context_is_broadcast
+    self._use_concrete_function = use_concrete_function
+    if use_concrete_function:
+      self._concrete_fn_cache = _ConcreteFunctionCache(
+          tf.function(self._call_impl, jit_compile=jit_compile or None))
+    self._input_signature = input_signature
+    if input_signature is None:
+      self._fixed_signature_fns = None
+    else:
+      if context_is_broadcast:
+        flat_signature = [
+            _flat_signature(input_signature[:2], self.compute_dtype),
+            _flat_signature(input_signature[2], self.compute_dtype)]
+      else:
+        flat_signature = [_flat_signature(input_signature, self.compute_dtype),
+                          []]
+      self._fixed_signature_fns = _FixedSignatureFunctions(
+          self._call_impl, flat_signature, jit_compile)
+
+  def get_config(self):
+    return dict(transformation=self._transformation,
+                jit_compile=self._jit_compile,
+                split_dense_kernel=self._split_dense_kernel,
+                context_is_broadcast=self._context_is_broadcast,
+                use_concrete_function=self._use_concrete_function,
+                input_signature=self._input_signature,
+                **super().get_config())
+
+  def build(self, input_shape):
+    # Building the transformation here, not while tracing a tf.function,
+    # keeps its variables in the name scope of this layer.
+    if ((self._split_dense_kernel or self._context_is_broadcast
+         or self._use_concrete_function or self._jit_compile
+         or self._fixed_signature_fns is not None)
+        and not self._transformation.built):
+      concat_shape = _concat_shape(input_shape)
+      if concat_shape is not None:
+        with tf.name_scope(self._transformation.name):
+          self._transformation.build(concat_shape)
+
+  def call(
+      self, inputs: Tuple[
+          const.FieldOrFields, const.FieldsNest, const.FieldsNest
+      ], training=None) -> const.FieldOrFields:
+    if self._context_is_broadcast:
+      flat_inputs = tf.nest.flatten(inputs[:2])
+      flat_context_inputs = tf.nest.flatten(inputs[2])
+    else:
+      flat_inputs = tf.nest.flatten(inputs)
+      flat_context_inputs = []
+    if (self._fixed_signature_fns is not None
+        and (training is None or isinstance(training, bool))):
+      return self._fixed_signature_fns.call(flat_inputs, flat_context_inputs,
+                                            training=training)
+    if (self._use_concrete_function
+        and (training is None or isinstance(training, bool))
+        and all(isinstance(x, tf.Tensor)
+                for x in flat_inputs + flat_context_inputs)):
+      return self._concrete_fn_cache.call(flat_inputs, flat_context_inputs,
+                                          training=training)
+    if self._jit_compile:
+      call_impl = self._jit_call_impl
+    else:
+      call_impl = self._call_impl
+    return call_impl(flat_inputs, flat_context_inputs, training=training)
+
+  def _call_impl(self, flat_inputs, flat_context_inputs, *, training):
+    if (flat_inputs and flat_context_inputs and _can_split_dense(
+        self._transformation, flat_inputs + flat_context_inputs)):
+      return _dense_with_broadcast_inputs(
+          self._transformation, flat_inputs, flat_context_inputs,
+          split_kernel=self._split_dense_kernel)
+    flat_inputs = flat_inputs + flat_context_inputs
+    if (self._split_dense_kernel
+        and _can_split_dense(self._transformation, flat_inputs)):
+      return _split_dense(self._transformation, flat_inputs)
+    net = _concat_features(flat_inputs)
+    net = self._transformation(net, training=training)
+    return net
+
+  _jit_call_impl = tf.function(_call_impl, jit_compile=True)
+
+
+@tf.keras.utils.register_keras_serializable(package="GNN")
+class NextStateFromSum(tf.keras.layers.Layer):
+  """Computes a new state by summing inputs and applying a Keras Layer.
+
+  This layer flattens all inputs into a list (forgetting their origin),
+  adds them up and sends the sum through a user-supplied feed-forward network.
+  All inputs must have the same shape.
+
+  Compared to `NextStateFromConcat`, this avoids the concatenation, and a
+  Dense transformation needs a kernel for one input's width instead of their
+  total width. In exchange, all inputs share the same projection. This is a
+  different model, not an optimization of `NextStateFromConcat`.
+
+  This layer can be restored from config by `tf.keras.models.load_model()`
+  when saved as part of a Keras model using `save_format="tf"`.
+
+  Init args:
+    transformation: Required. A Keras Layer to transform the sum of inputs
+      into the new state.
 
   Call returns:
     The result of transformation.
@@ -135,13 +555,22 @@ class NextStateFromConcat(tf.keras.layers.Layer):
     return dict(transformation=self._transformation,
                 **super().get_config())
 
+  def build(self, input_shape):
+    shapes = tf.nest.flatten(input_shape)
+    if not all(isinstance(s, tf.TensorShape) for s in shapes):
+      return
+    if any(not s.is_compatible_with(shapes[0]) for s in shapes):
+      raise ValueError(
+          "NextStateFromSum() requires inputs of the same shape, but got "
+          f"{[s.as_list() for s in shapes]}")
+
   def call(
       self, inputs: Tuple[
           const.FieldOrFields, const.FieldsNest, const.FieldsNest
-      ]) -> const.FieldOrFields:
-    net = tf.nest.flatten(inputs)
-    net = tf.concat(net, axis=-1)
-    net = self._transformation(net)
+      ], training=None) -> const.FieldOrFields:
+    flat_inputs = tf.nest.flatten(inputs)
+    net = tf.math.add_n(flat_inputs)
+    net = self._transformation(net, training=training)
     return net
 
 
@@ -160,6 +589,13 @@ class ResidualNextState(tf.keras.layers.Layer):
   the skip connection is omitted. This avoids the need to special-case, say,
   latent node sets in modeling code applied to different node sets.
 
+  This layer supports mixed precision. For example, after calling
+  `tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")`, floating-point
+  inputs are cast to bfloat16, the residual block runs in bfloat16 (with float32
+  variables), and the result of the residual block is added to the state
+  in bfloat16 as well, even if the residual block is configured to output
+  float32.
+
   This layer can be restored from config by `tf.keras.models.load_model()`
   when saved as part of a Keras model using `save_format="tf"`.
 
@@ -167,7 +603,7 @@ class ResidualNextState(tf.keras.layers.Layer):
     residual_block: Required. A Keras Layer to transform the concatenation
       of all inputs into a delta that gets added to the state.
     activation: An activation function (none by default), as understood by
-      `tf.keras.layers.Activation`. This activation function is applied after
+      `tf.keras.activations.get()`, or a Keras layer. This activation function is applied after
       the residual block and the addition. If using this, typically the
       residual block does not have an activation function on its last layer,
       or vice versa.
@@ -176,6 +612,22 @@ class ResidualNextState(tf.keras.layers.Layer):
       updated graph piece is a single tensor, that tensor is used, and this arg
       must not be set. If the input is a dict, this key is used; if unset, it
       defaults to `tfgnn.HIDDEN_STATE`.
+    jit_compile: If true, the computation from the concatenation of inputs up
+      to the activation is compiled with XLA (as by
+      `tf.function(jit_compile=True)`), which allows to fuse the addition of
+      the skip connection and the activation into the residual block's last
+      kernel. If the residual block is a Dense layer (or a Sequential model
+      ending in one) with a bias and no activation, its bias is added right
+      before the skip connection, so that XLA sees the matmul, both additions
+      and the activation as one chain. Defaults to false, because not all
+      platforms, input types and residual blocks support XLA.
+    split_dense_kernel: If true, `residual_block` must be a
+      `tf.keras.layers.Dense` layer, which is applied to the inputs as in
+      `NextStateFromConcat(..., split_dense_kernel=True)`: each input gets
+      multiplied with its row slice of the kernel, and the products are summed
+      up, without materializing the concatenated inputs. Defaults to false.
+    input_signature: Optionally, a nest of `tf.TensorSpec`s like the inputs,
+      with the same meaning as for `NextStateFromConcat`.
 
   Call returns:
     A tensor to use as the new state.
@@ -187,30 +639,105 @@ class ResidualNextState(tf.keras.layers.Layer):
       *,
       activation: Any = None,
       skip_connection_feature_name: Optional[const.FieldName] = None,
+      jit_compile: bool = False,
+      split_dense_kernel: bool = False,
+      input_signature: Optional[Any] = None,
       **kwargs,
   ):
     super().__init__(**kwargs)
+    if split_dense_kernel and not isinstance(residual_block,
+                                             tf.keras.layers.Dense):
+      raise ValueError(
+          "ResidualNextState(split_dense_kernel=True) requires a "
+          f"tf.keras.layers.Dense as residual_block, got {residual_block}")
     self._residual_block = residual_block
-    if isinstance(activation, tf.keras.layers.Layer):
+    # A plain function (instead of an Activation layer) lets graph optimizers
+    # see the addition of the skip connection and the activation next to each
+    # other, so they can fuse.
+    if activation is None or isinstance(activation, tf.keras.layers.Layer):
       self._activation = activation
     else:
-      self._activation = tf.keras.layers.Activation(activation)
+      self._activation = tf.keras.activations.get(activation)
     self._skip_connection_feature_name = skip_connection_feature_name
+    self._jit_compile = jit_compile
+    self._split_dense_kernel = split_dense_kernel
+    self._input_signature = input_signature
+    if input_signature is None:
+      self._fixed_signature_fns = None
+    else:
+      skip_connection_spec, skip_connection_msg = (
+          self._get_skip_connection_feature(input_signature[0]))
+      self._fixed_signature_fns = _FixedSignatureFunctions(
+          functools.partial(self._call_impl,
+                            skip_connection_msg=skip_connection_msg),
+          [_flat_signature(input_signature, self.compute_dtype),
+           _flat_signature(skip_connection_spec, self.compute_dtype)[0]],
+          jit_compile)
+    # Set by build().
+    self._skip_connection_getter = None
+    self._skip_connection_msg = None
+    self._omit_skip_connection = False
+    self._skip_connection_shape_checked = False
 
   def get_config(self):
     return dict(
         residual_block=self._residual_block,
         activation=self._activation,
         skip_connection_feature_name=self._skip_connection_feature_name,
+        jit_compile=self._jit_compile,
+        split_dense_kernel=self._split_dense_kernel,
+        input_signature=self._input_signature,
         **super().get_config())
 
-  def call(
-      self, inputs: Tuple[
-          const.FieldOrFields, const.FieldsNest, const.FieldsNest
-      ]) -> const.FieldOrFields:
-    # Extract the feature for a skip connection.
-    self_input = inputs[0]
-    if isinstance(self_input, (tf.Tensor, tf.RaggedTensor)):
+  def build(self, input_shape):
+    skip_connection_shape, skip_connection_msg = (
+        self._get_skip_connection_feature(input_shape[0]))
+    # The input from the updated graph piece keeps its structure from build()
+    # to call(), so the lookup of the skip connection can be fixed here.
+    if isinstance(input_shape[0], collections.abc.Mapping):
+      self._skip_connection_getter = operator.itemgetter(
+          self._get_skip_connection_feature_name())
+    else:
+      self._skip_connection_getter = lambda self_input: self_input
+    self._skip_connection_msg = skip_connection_msg
+    if skip_connection_shape[1:].num_elements() == 0:
+      tf.get_logger().warning(
+          "ResidualNextState() called on empty input state (latent node set?); "
+          "will omit residual link.")
+      self._omit_skip_connection = True
+      return
+
+    concat_shape = _concat_shape(input_shape)
+    if concat_shape is None:
+      return  # Check at tracing time of call.
+    if ((self._jit_compile or self._split_dense_kernel)
+        and not self._residual_block.built):
+      # Allows the first trace of call to split the kernel of a Dense
+      # residual block, or to defer the bias of a final Dense.
+      with tf.name_scope(self._residual_block.name):
+        self._residual_block.build(concat_shape)
+    try:
+      net_shape = tf.TensorShape(
+          self._residual_block.compute_output_shape(concat_shape))
+    except NotImplementedError:
+      return  # Check at tracing time of call.
+    self._check_skip_connection_shape(
+        skip_connection_shape, net_shape, skip_connection_msg)
+    self._skip_connection_shape_checked = True
+
+  def _check_skip_connection_shape(self, skip_connection_shape, net_shape,
+                                   skip_connection_msg):
+    if not skip_connection_shape.is_compatible_with(net_shape):
+      raise ValueError(
+          "A ResidualNextState() requires an update_fn whose "
+          "output has the same shape as the input state, but got "
+          f"output shape {net_shape.as_list()} vs "
+          f"input shape {skip_connection_shape.as_list()} "
+          f"from {skip_connection_msg}.")
+
+  def _get_skip_connection_feature(self, self_input):
+    """Returns the skip connection feature (or its shape) and a description."""
+    if not isinstance(self_input, collections.abc.Mapping):
       if self._skip_connection_feature_name is not None:
         raise KeyError(
             "ResidualNextState() invoked with explicit skip connection feature"
@@ -221,10 +748,7 @@ class ResidualNextState(tf.keras.layers.Layer):
       skip_connection_feature = self_input
       skip_connection_msg = "single input"
     else:
-      if self._skip_connection_feature_name is None:
-        skip_connection_feature_name = const.HIDDEN_STATE
-      else:
-        skip_connection_feature_name = self._skip_connection_feature_name
+      skip_connection_feature_name = self._get_skip_connection_feature_name()
       try:
         skip_connection_feature = self_input[skip_connection_feature_name]
       except KeyError as e:
@@ -235,27 +759,76 @@ class ResidualNextState(tf.keras.layers.Layer):
         ) from e
       skip_connection_msg = (
           f"input feature '{skip_connection_feature_name}'")
+    return skip_connection_feature, skip_connection_msg
+
+  def _get_skip_connection_feature_name(self):
+    if self._skip_connection_feature_name is None:
+      return const.HIDDEN_STATE
+    return self._skip_connection_feature_name
+
+  def call(
+      self, inputs: Tuple[
+          const.FieldOrFields, const.FieldsNest, const.FieldsNest
+      ], training=None) -> const.FieldOrFields:
+    # Extract the feature for a skip connection, as validated by build().
+    skip_connection_feature = self._skip_connection_getter(inputs[0])
 
     # Compute the state update.
-    net = tf.nest.flatten(inputs)
-    net = tf.concat(net, axis=-1)
-    net = self._residual_block(net)
-    if skip_connection_feature.shape[1:].num_elements() == 0:
-      tf.get_logger().warning(
-          "ResidualNextState() called on empty input state (latent node set?); "
-          "will omit residual link.")
-    elif not skip_connection_feature.shape.is_compatible_with(net.shape):
-      raise ValueError(
-          "A ResidualNextState() requires an update_fn whose "
-          "output has the same shape as the input state, but got "
-          f"output shape {net.shape.as_list()} vs "
-          f"input shape {skip_connection_feature.shape.as_list()} "
-          f"from {skip_connection_msg}.")
+    flat_inputs = tf.nest.flatten(inputs)
+    if (self._fixed_signature_fns is not None
+        and (training is None or isinstance(training, bool))):
+      return self._fixed_signature_fns.call(
+          flat_inputs, skip_connection_feature, training=training)
+    if self._jit_compile:
+      call_impl = self._jit_call_impl
+    else:
+      call_impl = self._call_impl
+    return call_impl(flat_inputs, skip_connection_feature,
+                     skip_connection_msg=self._skip_connection_msg,
+                     training=training)
+
+  def _call_impl(self, flat_inputs, skip_connection_feature, *,
+                 skip_connection_msg, training):
+    if (self._split_dense_kernel
+        and _can_split_dense(self._residual_block, flat_inputs)):
+      net = _split_dense(self._residual_block, flat_inputs)
+      bias = None
     else:
-      net = tf.add(net, skip_connection_feature)
-    net = self._activation(net)
+      net = _concat_features(flat_inputs)
+      net, bias = self._call_residual_block(net, training=training)
+    if not self._omit_skip_connection:
+      if not self._skip_connection_shape_checked:
+        # Not possible in build(); this happens in Python at tracing time.
+        self._check_skip_connection_shape(
+            skip_connection_feature.shape, net.shape, skip_connection_msg)
+      if bias is not None:
+        net = tf.nn.bias_add(net, bias)
+      # Under mixed precision, add in the compute dtype of the skip connection.
+      net = tf.cast(net, skip_connection_feature.dtype)
+      if (isinstance(net, tf.Tensor)
+          and isinstance(skip_connection_feature, tf.Tensor)):
+        net = tf.raw_ops.AddV2(x=net, y=skip_connection_feature)
+      else:
+        net = tf.add(net, skip_connection_feature)
+    if self._activation is not None:
+      net = self._activation(net)
     return net
 
+  def _call_residual_block(self, net, *, training):
+    """Returns the residual block's result and a bias still to be added."""
+    final_dense = None
+    if self._jit_compile and not self._omit_skip_connection:
+      final_dense = _split_final_dense(self._residual_block)
+    if final_dense is None:
+      return self._residual_block(net, training=training), None
+    # Defer the bias of the final Dense layer to the epilogue of the caller.
+    head, dense = final_dense
+    for layer in head:
+      net = layer(net, training=training)
+    return _dense_without_bias(dense, net)
+
+  _jit_call_impl = tf.function(_call_impl, jit_compile=True)
+
 
 @tf.keras.utils.register_keras_serializable(package="GNN")
 class SingleInputNextState(tf.keras.layers.Layer):
@@ -288,3 +861,108 @@ class SingleInputNextState(tf.keras.layers.Layer):
           " This layer should take only a single input."
       ) from e
     return single_input
+
+
+class CompiledNextState(NamedTuple):
+  """The result of `tfgnn.keras.layers.compile_next_state()`.
+
+  Attributes:
+    function: A concrete function that computes the NextState layer's output
+      for inputs with exactly the same structure, shapes and dtypes as the
+      sample inputs, compiled with XLA into one cluster.
+    hlo_text: The XLA HLO module of `function`, as text (before the
+      optimizations of the XLA compiler).
+  """
+  function: Any
+  hlo_text: str
+
+
+def compile_next_state(layer: tf.keras.layers.Layer,
+                       sample_inputs: Tuple[const.FieldOrFields,
+                                            const.FieldsNest,
+                                            const.FieldsNest],
+                       *,
+                       training: bool = False) -> CompiledNextState:
+  """Compiles a NextState layer with XLA for fixed input shapes.
+
+  NextState layers are typically small and called many times on inputs of
+  the same shape, e.g., for graphs padded to fixed sizes. Compiling them
+  ahead of use, specialized to the exact input shapes, lets XLA fuse all
+  their ops into a few kernels. The returned HLO text can be stored or
+  passed on to other XLA-based toolchains.
+
+  The layer is built by calling it on `sample_inputs`, if needed. XLA does
+  not support ragged tensors, so all inputs must be dense tensors.
+
+  Args:
+    layer: A NextState layer, such as `tfgnn.keras.layers.NextStateFromConcat`.
+    sample_inputs: Inputs to `layer`. Their shapes and dtypes define the
+      input signature of the compiled function.
+    training: The value of the `training` argument for calling the layer.
+
+  Returns:
+    A `tfgnn.keras.layers.CompiledNextState` with the concrete function and
+    its HLO text.
+  """
+  fn = _xla_function(layer, sample_inputs, training=training)
+  hlo_text = fn.experimental_get_compiler_ir(sample_inputs)(stage="hlo")
+  return CompiledNextState(function=fn.get_concrete_function(),
+                           hlo_text=hlo_text)
+
+
+def export_next_state(layer: tf.keras.layers.Layer,
+                      sample_inputs: Tuple[const.FieldOrFields,
+                                           const.FieldsNest,
+                                           const.FieldsNest],
+                      export_dir: str,
+                      *,
+                      training: bool = False) -> None:
+  """Saves a NextState layer XLA-compiled for fixed input shapes.
+
+  This writes a SavedModel to `export_dir` for serving the layer on inputs
+  with the same structure, shapes and dtypes as `sample_inputs`, like the
+  function from `tfgnn.keras.layers.compile_next_state()`. It can be used from
+  Python as
+
+  ```python
+  loaded = tf.saved_model.load(export_dir)
+  outputs = loaded.serve(inputs)
+  ```
+
+  The function `serve` keeps its `jit_compile=True` setting, so it is
+  compiled with XLA on its first call in the loading process. (XLA does not
+  store the compiled kernels in the SavedModel.) Servers with a tight
+  latency budget should call it once on sample inputs before real traffic.
+
+  The layer is built by calling it on `sample_inputs`, if needed. XLA does
+  not support ragged tensors, so all inputs must be dense tensors.
+
+  Args:
+    layer: A NextState layer, such as `tfgnn.keras.layers.NextStateFromConcat`.
+    sample_inputs: Inputs to `layer`. Their shapes and dtypes define the
+      input signature of the exported function.
+    export_dir: The directory to write the SavedModel to.
+    training: The value of the `training` argument for calling the layer.
+  """
+  module = tf.Module()
+  module.layer = layer  # Tracks the variables.
+  module.serve = _xla_function(layer, sample_inputs, training=training)
+  _ = module.serve.get_concrete_function()  # Traces for the fixed signature.
+  tf.saved_model.save(module, export_dir)
+
+
+def _xla_function(layer: tf.keras.layers.Layer,
+                  sample_inputs: Any,
+                  *,
+                  training: bool) -> Any:
+  """Returns a `tf.function` that calls `layer` with XLA on fixed shapes."""
+  if not layer.built:
+    _ = layer(sample_inputs, training=training)
+  input_signature = tf.nest.map_structure(tf.TensorSpec.from_tensor,
+                                          sample_inputs)
+
+  @tf.function(jit_compile=True, input_signature=[input_signature])
+  def fn(inputs):
+    return layer(inputs, training=training)
+
+  return fn
@@ -14,6 +14,8 @@
 # ==============================================================================
 """Tests for the NextState layers."""
 
+import os
+
 from absl.testing import parameterized
 import tensorflow as tf
 from tensorflow_gnn.graph import graph_constants as const
@@ -44,30 +46,267 @@ class NextStateFromConcatTest(tf.test.TestCase, parameterized.TestCase):
                          tf.constant([[5.]])))
     self.assertAllEqual([[2., 4., 6., 8., 10.]], actual)
 
+  @parameterized.named_parameters(
+      ("EqualWidths", [2, 2, 2]),
+      ("DifferentWidths", [2, 1, 3]))
+  def testConcatOrder(self, widths):
+    values = iter(range(1, 1 + 2 * sum(widths)))
+    inputs = [tf.constant([[float(next(values)) for _ in range(w)]
+                           for _ in range(2)])
+              for w in widths]
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(sum(widths), use_bias=False,
+                              kernel_initializer="identity"))
+    actual = next_state((inputs[0], {"edges": inputs[1]}, inputs[2]))
+    self.assertAllEqual(tf.concat(inputs, axis=-1), actual)
+
+  def testConcatZeroWidths(self):
+    actual = next_state_lib._concat_features([tf.zeros([3, 0]),
+                                              tf.zeros([3, 0])])
+    self.assertEqual([3, 0], actual.shape)
+
+  def testRaggedInputs(self):
+    inputs = [tf.ragged.constant([[[1., 2.]], [[3., 4.], [5., 6.]]],
+                                 ragged_rank=1),
+              tf.ragged.constant([[[7.]], [[8.], [9.]]], ragged_rank=1)]
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(3, use_bias=False,
+                              kernel_initializer="identity"))
+    actual = next_state((inputs[0], {"edges": inputs[1]}, {}))
+    self.assertIsInstance(actual, tf.RaggedTensor)
+    self.assertAllEqual(tf.concat(inputs, axis=-1), actual)
+
   @parameterized.named_parameters(
       ("", tftu.ModelReloading.SKIP),
       ("Restored", tftu.ModelReloading.SAVED_MODEL),
       ("RestoredKeras", tftu.ModelReloading.KERAS))
-  def testModel(self, model_reloading):
+  def testSplitDenseKernel(self, model_reloading):
+    test_input = [tf.constant([[1., 2.], [3., 4.]]),
+                  tf.constant([[5.], [6.]]),
+                  tf.constant([[7., 8., 9.], [10., 11., 12.]])]
+    model_input = [tf.keras.Input([2]), tf.keras.Input([1]),
+                   tf.keras.Input([3])]
+    kernel = [[1., 0.], [0., 1.], [-1., 0.], [1., 1.], [0., -1.], [2., 2.]]
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(
+            2, activation="relu",
+            kernel_initializer=tf.keras.initializers.Constant(kernel),
+            bias_initializer=tf.keras.initializers.Constant([0.5, -0.5])),
+        split_dense_kernel=True)
+    model_output = next_state((model_input[0],
+                               {"edges": model_input[1]},
+                               model_input[2]))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model(test_input)  # Trigger model building.
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "next-state-from-concat-split-dense")
+    actual = model(test_input)
+    expected = tf.nn.relu(
+        tf.matmul(tf.concat(test_input, axis=-1), kernel) + [0.5, -0.5])
+    self.assertAllClose(expected, actual)
+
+  def testSplitDenseKernelRequiresDense(self):
+    with self.assertRaisesRegex(ValueError, r"requires a tf.keras.layers.Dense"):
+      _ = next_state_lib.NextStateFromConcat(
+          tf.keras.Sequential([tf.keras.layers.Dense(2)]),
+          split_dense_kernel=True)
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("SplitDenseKernel", tftu.ModelReloading.SKIP, True),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testContextIsBroadcast(self, model_reloading, split_dense_kernel=False):
+    test_input = [tf.constant([[1., 2.], [3., 4.], [5., 6.]]),
+                  tf.constant([[5.], [6.], [7.]]),
+                  tf.constant([[7., 8., 9.]] * 3)]
+    model_input = [tf.keras.Input([2]), tf.keras.Input([1]),
+                   tf.keras.Input([3])]
+    kernel = [[1., 0.], [0., 1.], [-1., 0.], [1., 1.], [0., -1.], [2., 2.]]
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(
+            2, activation="relu",
+            kernel_initializer=tf.keras.initializers.Constant(kernel),
+            bias_initializer=tf.keras.initializers.Constant([0.5, -0.5])),
+        split_dense_kernel=split_dense_kernel,
+        context_is_broadcast=True)
+    model_output = next_state((model_input[0],
+                               {"edges": model_input[1]},
+                               model_input[2]))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model(test_input)  # Trigger model building.
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "next-state-from-concat-broadcast")
+    actual = model(test_input)
+    expected = tf.nn.relu(
+        tf.matmul(tf.concat(test_input, axis=-1), kernel) + [0.5, -0.5])
+    self.assertAllClose(expected, actual)
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS),
+      ("JitCompiled", tftu.ModelReloading.SKIP, True),
+      ("JitCompiledRestored", tftu.ModelReloading.SAVED_MODEL, True),
+      ("JitCompiledRestoredKeras", tftu.ModelReloading.KERAS, True))
+  def testModel(self, model_reloading, jit_compile=False):
     test_input = tf.constant([[1.]])
     model_input = tf.keras.Input([1], dtype=tf.float32)
     init_double = tf.keras.initializers.Identity(gain=2.0)
+    dense = tf.keras.layers.Dense(1, use_bias=False,
+                                  kernel_initializer=init_double)
     next_state = next_state_lib.NextStateFromConcat(
-        tf.keras.layers.Dense(1, use_bias=False,
-                              kernel_initializer=init_double))
+        dense, jit_compile=jit_compile)
     model_output = next_state((model_input, {}, {}))
     model = tf.keras.Model(model_input, model_output)
     _ = model(test_input)  # Trigger model building.
+    self.assertEqual([f"{next_state.name}/{dense.name}/kernel:0"],
+                     [v.name for v in next_state.weights])
     model = tftu.maybe_reload_model(self, model, model_reloading,
                                     "next-state-from-concat")
     actual = model(test_input)
     self.assertAllEqual([[2.]], actual)
 
+  def testJitCompiledWeightNamesEager(self):
+    dense = tf.keras.layers.Dense(2)
+    next_state = next_state_lib.NextStateFromConcat(dense, jit_compile=True)
+    _ = next_state((tf.constant([[1.]]), {"edges": tf.constant([[2.]])}, {}))
+    self.assertEqual([f"{next_state.name}/{dense.name}/kernel:0",
+                      f"{next_state.name}/{dense.name}/bias:0"],
+                     [v.name for v in next_state.weights])
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testUseConcreteFunction(self, model_reloading):
+    init_double = tf.keras.initializers.Identity(gain=2.0)
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(2, use_bias=False,
+                              kernel_initializer=init_double),
+        use_concrete_function=True)
+    # Eager calls with different batch sizes.
+    self.assertAllEqual(
+        [[2., 4.]],
+        next_state((tf.constant([[1.]]), {"edges": tf.constant([[2.]])}, {})))
+    self.assertAllEqual(
+        [[2., 4.], [6., 8.]],
+        next_state((tf.constant([[1.], [3.]]),
+                    {"edges": tf.constant([[2.], [4.]])}, {})))
+
+    model_input = [tf.keras.Input([1]), tf.keras.Input([1])]
+    model_output = next_state((model_input[0], {"edges": model_input[1]}, {}))
+    model = tf.keras.Model(model_input, model_output)
+    test_input = [tf.constant([[1.]]), tf.constant([[3.]])]
+    _ = model(test_input)  # Trigger model building.
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "next-state-from-concat-concrete-fn")
+    self.assertAllEqual([[2., 6.]], model(test_input))
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testInputSignature(self, model_reloading):
+    init_double = tf.keras.initializers.Identity(gain=2.0)
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(2, use_bias=False,
+                              kernel_initializer=init_double),
+        input_signature=(tf.TensorSpec([None, 1]),
+                         {"edges": tf.TensorSpec([None, 1])},
+                         {}))
+    model_input = [tf.keras.Input([1]), tf.keras.Input([1])]
+    model_output = next_state((model_input[0], {"edges": model_input[1]}, {}))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model([tf.constant([[1.]]), tf.constant([[3.]])])
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "next-state-from-concat-signature")
+    self.assertAllEqual(
+        [[2., 6.], [4., 8.]],
+        model([tf.constant([[1.], [2.]]), tf.constant([[3.], [4.]])]))
+
+  def testInputSignatureMismatch(self):
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(2),
+        input_signature=(tf.TensorSpec([None, 1]), {}, {}))
+    with self.assertRaises((TypeError, ValueError)):
+      _ = next_state((tf.constant([[1., 2.]]), {}, {}))
+
+  @parameterized.named_parameters(
+      ("", False),
+      ("SplitDenseKernel", True))
+  def testMixedPrecision(self, split_dense_kernel):
+    init_double = tf.keras.initializers.Identity(gain=2.0)
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(3, use_bias=False,
+                              kernel_initializer=init_double,
+                              dtype="mixed_bfloat16"),
+        split_dense_kernel=split_dense_kernel,
+        dtype="mixed_bfloat16")
+    actual = next_state((tf.constant([[1.]]),
+                         {"edges": tf.constant([[2.]])},
+                         tf.constant([[3.]])))
+    self.assertEqual(tf.bfloat16, actual.dtype)
+    self.assertAllEqual([[2., 4., 6.]], tf.cast(actual, tf.float32))
+    self.assertEqual(tf.float32, next_state.weights[0].dtype)
+
   def testTFLite(self):
     self.skipTest(
         "NextStateFromConcat TFLite functionality is tested in models/mt_albis")
 
 
+class NextStateFromSumTest(tf.test.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    const.enable_graph_tensor_validation_at_runtime()
+
+  def testBasic(self):
+    init_double = tf.keras.initializers.Identity(gain=2.0)
+    next_state = next_state_lib.NextStateFromSum(
+        tf.keras.layers.Dense(2, use_bias=False,
+                              kernel_initializer=init_double))
+    actual = next_state((tf.constant([[1., -1.]]),
+                         {"a": tf.constant([[2., -2.]]),
+                          "b": tf.constant([[3., -3.]])},
+                         tf.constant([[4., -4.]])))
+    self.assertAllEqual([[20., -20.]], actual)
+
+  def testShapeMismatchThrowsException(self):
+    next_state = next_state_lib.NextStateFromSum(tf.keras.layers.Dense(2))
+    with self.assertRaisesRegex(ValueError, r"requires inputs of the same"):
+      _ = next_state((tf.constant([[1., 2.]]), {"edges": tf.constant([[3.]])},
+                      {}))
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testModel(self, model_reloading):
+    test_input = [tf.constant([[1.]]), tf.constant([[2.]])]
+    model_input = [tf.keras.Input([1], dtype=tf.float32) for _ in range(2)]
+    init_double = tf.keras.initializers.Identity(gain=2.0)
+    next_state = next_state_lib.NextStateFromSum(
+        tf.keras.layers.Dense(1, use_bias=False,
+                              kernel_initializer=init_double))
+    model_output = next_state((model_input[0], {"edges": model_input[1]}, {}))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model(test_input)  # Trigger model building.
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "next-state-from-sum")
+    actual = model(test_input)
+    self.assertAllEqual([[6.]], actual)
+
+
+class _IdentityWithoutOutputShape(tf.keras.layers.Layer):
+
+  def call(self, inputs):
+    return inputs
+
+  def compute_output_shape(self, input_shape):
+    raise NotImplementedError()
+
+
 class ResidualNextStateTest(tf.test.TestCase, parameterized.TestCase):
 
   def setUp(self):
@@ -103,8 +342,11 @@ class ResidualNextStateTest(tf.test.TestCase, parameterized.TestCase):
   @parameterized.named_parameters(
       ("", tftu.ModelReloading.SKIP),
       ("Restored", tftu.ModelReloading.SAVED_MODEL),
-      ("RestoredKeras", tftu.ModelReloading.KERAS))
-  def testModel(self, model_reloading):
+      ("RestoredKeras", tftu.ModelReloading.KERAS),
+      ("JitCompiled", tftu.ModelReloading.SKIP, True),
+      ("JitCompiledRestored", tftu.ModelReloading.SAVED_MODEL, True),
+      ("JitCompiledRestoredKeras", tftu.ModelReloading.KERAS, True))
+  def testModel(self, model_reloading, jit_compile=False):
     test_input = [tf.constant([[1., 1.]]), tf.constant([[2., 2.]])]
     model_input = [tf.keras.Input([2], dtype=tf.float32) for _ in range(2)]
 
@@ -112,7 +354,8 @@ class ResidualNextStateTest(tf.test.TestCase, parameterized.TestCase):
     next_state = next_state_lib.ResidualNextState(
         tf.keras.layers.Dense(2, use_bias=False,
                               kernel_initializer=init_plus_minus),
-        activation="relu", skip_connection_feature_name="my_feature")
+        activation="relu", skip_connection_feature_name="my_feature",
+        jit_compile=jit_compile)
     model_output = next_state((
         {"my_feature": model_input[0], "other_feature": model_input[1]},
         {}, {}
@@ -128,6 +371,109 @@ class ResidualNextStateTest(tf.test.TestCase, parameterized.TestCase):
     ]]
     self.assertAllClose(expected, actual)
 
+  @parameterized.named_parameters(
+      ("Dense", False),
+      ("Sequential", True))
+  def testJitCompiledWithFinalDense(self, sequential):
+    inputs = (tf.constant([[1., 2.], [3., -4.]]),
+              {"edges": tf.constant([[1., -1., 0.5], [2., 0., -3.]])},
+              {})
+    outputs = []
+    for jit_compile in [False, True]:
+      tf.keras.utils.set_random_seed(42)
+      residual_block = tf.keras.layers.Dense(
+          2, bias_initializer=tf.keras.initializers.Constant([0.5, -0.5]))
+      if sequential:
+        residual_block = tf.keras.Sequential([
+            tf.keras.layers.Dense(4, activation="relu"), residual_block])
+      next_state = next_state_lib.ResidualNextState(
+          residual_block, activation="relu", jit_compile=jit_compile)
+      outputs.append(next_state(inputs))
+    self.assertAllClose(outputs[0], outputs[1])
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("JitCompiled", tftu.ModelReloading.SKIP, True),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testSplitDenseKernel(self, model_reloading, jit_compile=False):
+    test_input = [tf.constant([[1., 2.], [3., 4.]]),
+                  tf.constant([[5.], [6.]]),
+                  tf.constant([[7., 8., 9.], [10., 11., 12.]])]
+    model_input = [tf.keras.Input([2]), tf.keras.Input([1]),
+                   tf.keras.Input([3])]
+    kernel = [[1., 0.], [0., 1.], [-1., 0.], [1., 1.], [0., -1.], [2., 2.]]
+    next_state = next_state_lib.ResidualNextState(
+        tf.keras.layers.Dense(
+            2, kernel_initializer=tf.keras.initializers.Constant(kernel),
+            bias_initializer=tf.keras.initializers.Constant([0.5, -0.5])),
+        activation="relu",
+        jit_compile=jit_compile,
+        split_dense_kernel=True)
+    model_output = next_state((model_input[0],
+                               {"edges": model_input[1]},
+                               model_input[2]))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model(test_input)  # Trigger model building.
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "residual-next-state-split-dense")
+    actual = model(test_input)
+    expected = tf.nn.relu(
+        test_input[0] +
+        tf.matmul(tf.concat(test_input, axis=-1), kernel) + [0.5, -0.5])
+    self.assertAllClose(expected, actual)
+
+  def testSplitDenseKernelRequiresDense(self):
+    with self.assertRaisesRegex(ValueError, r"requires a tf.keras.layers.Dense"):
+      _ = next_state_lib.ResidualNextState(
+          tf.keras.Sequential([tf.keras.layers.Dense(2)]),
+          split_dense_kernel=True)
+
+  @parameterized.named_parameters(
+      ("", tftu.ModelReloading.SKIP),
+      ("JitCompiled", tftu.ModelReloading.SKIP, True),
+      ("Restored", tftu.ModelReloading.SAVED_MODEL),
+      ("RestoredKeras", tftu.ModelReloading.KERAS))
+  def testInputSignature(self, model_reloading, jit_compile=False):
+    next_state = next_state_lib.ResidualNextState(
+        tf.keras.layers.Dense(2, use_bias=False, kernel_initializer="identity"),
+        activation="relu",
+        jit_compile=jit_compile,
+        input_signature=({const.HIDDEN_STATE: tf.TensorSpec([None, 2])},
+                         {"edges": tf.TensorSpec([None, 0])},
+                         {}))
+    model_input = [tf.keras.Input([2]), tf.keras.Input([0])]
+    model_output = next_state(({const.HIDDEN_STATE: model_input[0]},
+                               {"edges": model_input[1]}, {}))
+    model = tf.keras.Model(model_input, model_output)
+    _ = model([tf.constant([[1., -1.]]), tf.zeros([1, 0])])
+    model = tftu.maybe_reload_model(self, model, model_reloading,
+                                    "residual-next-state-signature")
+    self.assertAllEqual(
+        [[2., 0.], [4., 6.]],
+        model([tf.constant([[1., -1.], [2., 3.]]), tf.zeros([2, 0])]))
+
+  def testNoActivation(self):
+    next_state = next_state_lib.ResidualNextState(
+        tf.keras.layers.Dense(1, use_bias=False, kernel_initializer="ones"))
+    actual = next_state((tf.constant([[-4.]]), {"edges": tf.constant([[2.]])},
+                         {}))
+    self.assertAllEqual([[-4. + (-4. + 2.)]], actual)
+    self.assertIsNone(next_state.get_config()["activation"])
+
+  def testActivationFromCustomObjectScope(self):
+    def make_next_state():
+      return next_state_lib.ResidualNextState(
+          tf.keras.layers.Dense(1, use_bias=False, kernel_initializer="ones"),
+          activation="my_activation")
+    inputs = (tf.constant([[1.]]), {"edges": tf.constant([[2.]])}, {})
+    with tf.keras.utils.custom_object_scope(
+        {"my_activation": lambda x: 2. * x}):
+      self.assertAllEqual([[2. * (1. + 3.)]], make_next_state()(inputs))
+    with tf.keras.utils.custom_object_scope(
+        {"my_activation": lambda x: -x}):
+      self.assertAllEqual([[-(1. + 3.)]], make_next_state()(inputs))
+
   def testEmptyState(self):
     first_input = {const.HIDDEN_STATE: tf.constant([[]], tf.float32),
                    "other": tf.constant([[2.]])}
@@ -142,6 +488,36 @@ class ResidualNextStateTest(tf.test.TestCase, parameterized.TestCase):
     actual = next_state((first_input, second_input, third_input))
     self.assertAllEqual([[1. + 2. + 4.]], actual)
 
+  @parameterized.named_parameters(
+      ("", "mixed_bfloat16"),
+      ("Float32ResidualBlock", "float32"))
+  def testMixedPrecision(self, residual_block_dtype):
+    init_div2 = tf.keras.initializers.Constant(0.5)
+    next_state = next_state_lib.ResidualNextState(
+        tf.keras.layers.Dense(1, use_bias=False, kernel_initializer=init_div2,
+                              dtype=residual_block_dtype),
+        activation="relu",
+        dtype="mixed_bfloat16")
+    actual = next_state((tf.constant([[4.]]),
+                         {"edges": tf.constant([[2.]])},
+                         {}))
+    self.assertEqual(tf.bfloat16, actual.dtype)
+    self.assertAllEqual([[4. + 3.]], tf.cast(actual, tf.float32))
+
+  @parameterized.named_parameters(
+      ("Dense", False),
+      ("CustomLayer", True))
+  def testShapeMismatchThrowsException(self, custom_layer):
+    if custom_layer:
+      # Without compute_output_shape(), the check happens during the call.
+      residual_block = _IdentityWithoutOutputShape()
+    else:
+      residual_block = tf.keras.layers.Dense(3)
+    next_state = next_state_lib.ResidualNextState(residual_block)
+    with self.assertRaisesRegex(ValueError, r"output shape \[.*, 3\]"):
+      _ = next_state((tf.constant([[1., 2.]]), {"edges": tf.constant([[3.]])},
+                      {}))
+
   def testMissingDictionaryThrowsException(self):
     first_input = tf.constant([[32.0]])
     init_div2 = tf.keras.initializers.Constant(0.5)
@@ -246,5 +622,32 @@ class SingleInputNextStateTest(tf.test.TestCase, parameterized.TestCase):
     self.assertAllEqual([[2.]], actual)
 
 
+class CompileNextStateTest(tf.test.TestCase):
+
+  def test(self):
+    inputs = (tf.constant([[1., 2.], [3., 4.]]),
+              {"edges": tf.constant([[0.5], [-1.]])},
+              {})
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(2, activation="relu"))
+    compiled = next_state_lib.compile_next_state(next_state, inputs)
+    self.assertIn("HloModule", compiled.hlo_text)
+    self.assertAllClose(next_state(inputs), compiled.function(inputs))
+
+
+class ExportNextStateTest(tf.test.TestCase):
+
+  def test(self):
+    inputs = (tf.constant([[1., 2.], [3., 4.]]),
+              {"edges": tf.constant([[0.5], [-1.]])},
+              {})
+    next_state = next_state_lib.NextStateFromConcat(
+        tf.keras.layers.Dense(2, activation="relu"))
+    export_dir = os.path.join(self.get_temp_dir(), "next-state")
+    next_state_lib.export_next_state(next_state, inputs, export_dir)
+    loaded = tf.saved_model.load(export_dir)
+    self.assertAllClose(next_state(inputs), loaded.serve(inputs))
+
+
 if __name__ == "__main__":
   tf.test.main()
@@ -14,13 +14,52 @@
 # ==============================================================================
 """Contains GraphSAGE convolution layer implementations."""
 
-import copy
+import collections
+import contextlib
 from typing import Any, Callable, Collection, Optional, Set, Union
 
 import tensorflow as tf
 import tensorflow_gnn as tfgnn
 
 
+def _serialize_activation(activation: Callable[..., Any]) -> Any:
+  """Returns `activation` for get_config(), serialized if Keras can restore it.
+
+  Built-in activations, Keras layers and functions registered with Keras are
+  serialized. Any other callable is returned as is, because
+  `tf.keras.activations.get()` could not restore it from its serialization.
+
+  Args:
+    activation: The result of `tf.keras.activations.get()`.
+  """
+  if isinstance(activation, tf.keras.layers.Layer):
+    return tf.keras.activations.serialize(activation)
+  name = getattr(activation, "__name__", None)
+  if name is None or name == "<lambda>":
+    return activation
+  registered_name = tf.keras.utils.get_registered_name(activation)
+  if tf.keras.utils.get_registered_object(registered_name) is activation:
+    return tf.keras.activations.serialize(activation)
+  serialized = tf.keras.activations.serialize(activation)
+  # Only built-in activations are serialized to their plain name.
+  return serialized if isinstance(serialized, str) else activation
+
+
+def _reenter_name_scope(name_scope: Optional[str]):
+  """Returns a context manager to re-enter `name_scope` from a tf.function.
+
+  A `tf.function` starts tracing from the empty name scope. Re-entering the
+  name scope of its caller keeps the names of variables created during tracing
+  (by building sublayers) the same as without the `tf.function`.
+
+  Args:
+    name_scope: The result of `tf.get_current_name_scope()` in the caller.
+  """
+  if not name_scope:
+    return contextlib.nullcontext()
+  return tf.name_scope(name_scope + "/")
+
+
 @tf.keras.utils.register_keras_serializable(package="GraphSAGE")
 class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
   """GraphSAGE: element-wise aggregation of neighbors and their linear transformation.
@@ -39,6 +78,11 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
   types besides "mean", see the reduce_type=... argument. For stateful
   transformation with a hidden layer, see `graph_sage.GraphSAGEPoolingConv`.
 
+  Under a mixed precision policy like "mixed_bfloat16", the linear
+  transformation computes in 16 bits, but the aggregation over neighbors is
+  done in float32 to avoid accumulating rounding errors for nodes with many
+  neighbors.
+
   This layer can be restored from config by `tf.keras.models.load_model()`
   when saved as part of a Keras model using `save_format="tf"`.
   """
@@ -51,6 +95,7 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
       sender_node_feature: Optional[tfgnn.FieldName] = tfgnn.HIDDEN_STATE,
       units: int,
       dropout_rate: float = 0.,
+      dropout_before_broadcast: bool = False,
       **kwargs):
     """Initializes the `GraphSAGEAggregatorConv` convolution layer.
 
@@ -69,6 +114,10 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
         sender node features.
       dropout_rate: Can be set to a dropout rate that will be applied to sender
         node features (independently on each edge).
+      dropout_before_broadcast: If true, dropout is applied to the sender node
+        features before they are broadcast to edges, which touches fewer values
+        if nodes have many edges. Note that this changes the dropout from
+        independent on each edge to shared by all edges of a sender node.
       **kwargs: Additional arguments for the Layer.
     """
     kwargs.setdefault("name", "graph_sage_aggregator_conv")
@@ -93,6 +142,7 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
     self._transform_neighbor_fn = tf.keras.layers.Dense(units, use_bias=False)
     self._dropout_rate = dropout_rate
     self._dropout = tf.keras.layers.Dropout(dropout_rate)
+    self._dropout_before_broadcast = dropout_before_broadcast
     self._reduce_type = reduce_type
 
   def get_config(self):
@@ -106,6 +156,7 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
         **config,
         units=self._units,
         dropout_rate=self._dropout_rate,
+        dropout_before_broadcast=self._dropout_before_broadcast,
         reduce_type=self._reduce_type)
 
   def convolve(self, *, sender_node_input: Optional[tf.Tensor],
@@ -119,12 +170,37 @@ class GraphSAGEAggregatorConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
     """Overridden internal method of the base class."""
     assert extra_receiver_ops is None, "Internal error: bad super().__init__()"
     assert sender_node_input is not None, "sender_node_input can't be None."
-    result = broadcast_from_sender_node(sender_node_input)
-    result = self._dropout(result, training=training)
+    if self._can_transform_before_broadcast(sender_node_input):
+      # The linear transformation commutes with a linear pooling, so it can be
+      # applied to the sender nodes, which makes the values on edges narrower.
+      result = self._dropout(sender_node_input, training=training)
+      result = self._transform_neighbor_fn(result)
+      result = broadcast_from_sender_node(result)
+      result = tf.cast(result, _accumulation_dtype(result.dtype))
+      result = pool_to_receiver(result, reduce_type=self._reduce_type)
+      return tf.cast(result, self._transform_neighbor_fn.compute_dtype)
+    if self._dropout_before_broadcast:
+      result = self._dropout(sender_node_input, training=training)
+      result = broadcast_from_sender_node(result)
+    else:
+      result = broadcast_from_sender_node(sender_node_input)
+      result = self._dropout(result, training=training)
+    compute_dtype = result.dtype
+    result = tf.cast(result, _accumulation_dtype(compute_dtype))
     result = pool_to_receiver(result, reduce_type=self._reduce_type)
+    result = tf.cast(result, compute_dtype)
     result = self._transform_neighbor_fn(result)
     return result
 
+  def _can_transform_before_broadcast(self, sender_node_input):
+    """Returns true if the transformation is better done on sender nodes."""
+    if self._reduce_type not in ("sum", "mean"):
+      return False
+    if self._dropout_rate and not self._dropout_before_broadcast:
+      return False  # Dropout on edges must come before the transformation.
+    input_units = sender_node_input.shape[-1]
+    return input_units is not None and self._units < input_units
+
 
 @tf.keras.utils.register_keras_serializable(package="GraphSAGE")
 class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
@@ -148,6 +224,10 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
   involves the aforementioned hidden layer. For element-wise aggregation (as in
   `tfgnn.pool_edges_to_node()`), see `graph_sage.GraphSAGEAggregatorConv`.
 
+  Under a mixed precision policy like "mixed_bfloat16", the fully connected
+  layers compute in 16 bits, but the aggregation over neighbors is done in
+  float32 to avoid accumulating rounding errors for nodes with many neighbors.
+
   This layer can be restored from config by `tf.keras.models.load_model()`
   when saved as part of a Keras model using `save_format="tf"`.
   """
@@ -163,6 +243,8 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
       use_bias: bool = True,
       dropout_rate: float = 0.,
       activation: Union[str, Callable[..., Any]] = "relu",
+      jit_compile: bool = False,
+      dropout_before_broadcast: bool = False,
       **kwargs):
     """Initializes the `GraphSAGEPoolingConv` convolution layer.
 
@@ -191,6 +273,16 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
         state and aggregated sender node features. This can be specified as a
         Keras layer, a tf.keras.activations.* function, or a string understood
         by `tf.keras.layers.Activation()`. Defaults to relu.
+      jit_compile: If true, the dropout and the hidden layer applied to the
+        sender node features on each edge are compiled with XLA (as by
+        `tf.function(jit_compile=True)`), which allows to fuse them into fewer
+        kernels. The broadcast and pooling along edges are not compiled.
+        Defaults to false, because not all platforms benefit from XLA.
+      dropout_before_broadcast: If true, dropout and the hidden layer are
+        applied to the sender node features before they are broadcast to
+        edges, which touches fewer values if nodes have many edges. Note that
+        this changes the dropout from independent on each edge to shared by all
+        edges of a sender node.
       **kwargs: Additional arguments for the Layer.
     """
     kwargs.setdefault("name", "graph_sage_pooling_conv")
@@ -222,6 +314,8 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
     self._transform_neighbor_fn = tf.keras.layers.Dense(
         self._units, use_bias=False)
     self._reduce_type = reduce_type
+    self._jit_compile = jit_compile
+    self._dropout_before_broadcast = dropout_before_broadcast
 
   def get_config(self):
     """Returns the config for Pooling Convolution."""
@@ -232,12 +326,14 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
       raise ValueError("init should guarantee sender_edge_feature=None")
     return dict(
         **config,
-        activation=self._activation,
+        activation=_serialize_activation(self._activation),
         units=self._units,
         hidden_units=self._hidden_units,
         dropout_rate=self._dropout_rate,
         use_bias=self._use_bias,
-        reduce_type=self._reduce_type)
+        reduce_type=self._reduce_type,
+        jit_compile=self._jit_compile,
+        dropout_before_broadcast=self._dropout_before_broadcast)
 
   def convolve(self, *, sender_node_input: Optional[tf.Tensor],
                sender_edge_input: Optional[tf.Tensor],
@@ -250,14 +346,78 @@ class GraphSAGEPoolingConv(tfgnn.keras.layers.AnyToAnyConvolutionBase):
     """Overridden internal method of the base class."""
     assert extra_receiver_ops is None, "Internal error: bad super().__init__()"
     assert sender_node_input is not None, "sender_node_input can't be None."
-    result = broadcast_from_sender_node(sender_node_input)
-    result = self._dropout(result, training=training)
-    # The "Pooling aggregator" from Eq. (3) of the paper, plus dropout.
-    result = self._pooling_transform_fn(result)
+    if self._dropout_before_broadcast:
+      # The hidden layer acts on each value separately, so it can be applied
+      # before the broadcast to edges.
+      result = self._transform_values(sender_node_input, training=training)
+      result = broadcast_from_sender_node(result)
+    else:
+      result = broadcast_from_sender_node(sender_node_input)
+      result = self._transform_values(result, training=training)
+    result = tf.cast(result, _accumulation_dtype(result.dtype))
     result = pool_to_receiver(result, reduce_type=self._reduce_type)
     result = self._transform_neighbor_fn(result)
     return result
 
+  def _transform_values(self, values, *, training):
+    """Returns the result of dropout and the hidden layer on `values`."""
+    if self._jit_compile:
+      return self._jit_dropout_and_transform(
+          values, training=training, name_scope=tf.get_current_name_scope())
+    return self._dropout_and_transform(values, training=training)
+
+  def _dropout_and_transform(self, values, *, training, name_scope=None):
+    with _reenter_name_scope(name_scope):
+      result = self._dropout(values, training=training)
+      # The "Pooling aggregator" from Eq. (3) of the paper, plus dropout.
+      result = self._pooling_transform_fn(result)
+    return result
+
+  _jit_dropout_and_transform = tf.function(_dropout_and_transform,
+                                           jit_compile=True,
+                                           reduce_retracing=True)
+
+
+def _accumulation_dtype(dtype: tf.DType) -> tf.DType:
+  """Returns the dtype for adding up many values of the given `dtype`."""
+  if dtype in (tf.float16, tf.bfloat16):
+    return tf.float32
+  return dtype
+
+
+@tf.custom_gradient
+def _gather_with_dense_gradient(params: tf.Tensor, indices: tf.Tensor):
+  """Like `tf.gather(params, indices)`, but with a dense gradient for `params`.
+
+  The gradient of `tf.gather()` is a `tf.IndexedSlices` with one row per index,
+  which gets converted to a dense tensor anyway by the ops that consume it.
+  Summing it up right away skips the sparse intermediate form.
+
+  Args:
+    params: The tensor to gather rows from.
+    indices: The indices of the rows to gather.
+
+  Returns:
+    The gathered rows and the gradient function.
+  """
+  def grad(upstream):
+    num_rows = tf.shape(params, out_type=indices.dtype)[0]
+    return tf.math.unsorted_segment_sum(upstream, indices, num_rows), None
+  return tf.gather(params, indices), grad
+
+
+def _sorted_segment_sum(data: tf.Tensor, segment_ids: tf.Tensor,
+                        num_segments: tf.Tensor) -> tf.Tensor:
+  """Like `tf.math.unsorted_segment_sum()`, computed after sorting by ids."""
+  order = tf.argsort(segment_ids, stable=True)
+  result = tf.math.segment_sum(tf.gather(data, order),
+                               tf.gather(segment_ids, order))
+  # segment_sum() stops at the largest id, so trailing segments are padded.
+  num_missing = (tf.cast(num_segments, segment_ids.dtype) -
+                 tf.shape(result, out_type=segment_ids.dtype)[0])
+  paddings = [[0, num_missing]] + [[0, 0]] * (data.shape.rank - 1)
+  return tf.pad(result, paddings)
+
 
 @tf.keras.utils.register_keras_serializable(package="GraphSAGE")
 class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
@@ -306,6 +466,10 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
   based on the reduce_type specified. If share_weights is set to True, then
   single weight matrix will be used in place of W_E and W_self.
 
+  Under a mixed precision policy like "mixed_bfloat16", the linear
+  transformations compute in 16 bits, but the reduce operation is done in
+  float32 to avoid accumulating rounding errors for nodes with many neighbors.
+
   This layer can be restored from config by `tf.keras.models.load_model()`
   when saved as part of a Keras model using `save_format="tf"`.
   """
@@ -323,6 +487,8 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
                use_bias: bool = False,
                share_weights: bool = False,
                add_self_loop: bool = True,
+               jit_compile: bool = False,
+               sort_by_receiver: bool = False,
                **kwargs):
     """Initializes GCNGraphSAGENodeSetUpdate node set update layer.
 
@@ -360,15 +526,30 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
         If set to False, each node state update uses only the inputs along the
         requested edge sets. Typically, this is done when loops are already
         contained among the edges.
+      jit_compile: If true, the dropout and linear transformation of each input
+        as well as the final combination of the results (up to and including
+        the activation) are compiled with XLA (as by
+        `tf.function(jit_compile=True)`), which allows to fuse them into fewer
+        kernels. The broadcast and pooling along edges are not compiled.
+        Defaults to false, because not all platforms benefit from XLA.
+      sort_by_receiver: If true, the inputs are sorted by their receiver nodes
+        before pooling, so that a sorted segment sum can be used instead of an
+        unsorted one. This avoids the atomic updates of the unsorted segment
+        sum on accelerators, which can be slow for nodes with many incoming
+        edges, at the cost of sorting the edges in each call.
       **kwargs:
     """
     kwargs.setdefault("name", "graph_sage_gcn_update")
     super().__init__(**kwargs)
     self._self_node_feature = self_node_feature
-    self._edge_set_names = copy.deepcopy(edge_set_names)
+    if isinstance(edge_set_names, (set, frozenset)):
+      # Sort for a deterministic order of weights and traced ops.
+      edge_set_names = sorted(edge_set_names)
+    self._edge_set_names = tuple(edge_set_names)
     self._units = units
     self._activation = tf.keras.activations.get(activation)
     self._receiver_tag = receiver_tag
+    self._sender_tag = tfgnn.reverse_tag(receiver_tag)
     self._reduce_type = reduce_type
     self._dropout_rate = dropout_rate
     self._dropout = tf.keras.layers.Dropout(dropout_rate)
@@ -377,19 +558,24 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
     self._sender_node_feature = sender_node_feature
     if not self._share_weights:
       self._transform_edge_fn_dict = dict()
-      for edge_set_name in edge_set_names:
+      for edge_set_name in self._edge_set_names:
         self._transform_edge_fn_dict[edge_set_name] = tf.keras.layers.Dense(
             self._units, use_bias=False)
     if self._add_self_loop or self._share_weights:
       self._node_transform_fn = tf.keras.layers.Dense(
           self._units, use_bias=False)
+    else:
+      # Not needed, so it must not be tracked or create any weights.
+      self._node_transform_fn = None
+    self._jit_compile = jit_compile
+    self._sort_by_receiver = sort_by_receiver
     self._use_bias = use_bias
     if self._use_bias:
       self._bias_term = self.add_weight(
           name="bias",
-          shape=[self._units],
+          shape=(self._units,),
           trainable=True,
-          initializer=tf.keras.initializers.Zeros())
+          initializer="zeros")
 
   def get_config(self):
     """Returns the config for the convolution."""
@@ -403,10 +589,12 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
         sender_node_feature=self._sender_node_feature,
         units=self._units,
         dropout_rate=self._dropout_rate,
-        activation=self._activation,
+        activation=_serialize_activation(self._activation),
         use_bias=self._use_bias,
         share_weights=self._share_weights,
-        add_self_loop=self._add_self_loop)
+        add_self_loop=self._add_self_loop,
+        jit_compile=self._jit_compile,
+        sort_by_receiver=self._sort_by_receiver)
 
   def call(self,
            graph: tfgnn.GraphTensor,
@@ -419,66 +607,204 @@ class GCNGraphSAGENodeSetUpdate(tf.keras.layers.Layer):
       raise ValueError(
           f"{self._reduce_type} isn't supported, please instead use any of "
           "['sum', 'mean']")
-    edge_set_in_degrees_list = []
-    pooled_node_states_list = []
+    node_set = graph.node_sets[node_set_name]
+    total_size = node_set.total_size
+    # Each edge set's adjacency is looked up once, for all that follows.
+    sender_node_values_list = []
+    input_keys = []
+    sender_indices_list = []
+    receiver_indices_list = []
     for edge_set_name in self._edge_set_names:
-      edge_set = graph.edge_sets[edge_set_name]
-      if node_set_name != edge_set.adjacency.node_set_name(self._receiver_tag):
+      adjacency = graph.edge_sets[edge_set_name].adjacency
+      if node_set_name != adjacency.node_set_name(self._receiver_tag):
         raise ValueError(
             f"Incorrect {edge_set_name} that has a different node at "
             f"receiver_tag:{self._receiver_tag} other than {node_set_name}.")
-      sender_node_set_name = edge_set.adjacency.node_set_name(
-          tfgnn.reverse_tag(self._receiver_tag))
-      sender_node_values = graph.node_sets[sender_node_set_name][
-          self._sender_node_feature]
-      sender_node_values = self._dropout(sender_node_values)
-      if not self._share_weights:
-        sender_node_values = self._transform_edge_fn_dict[edge_set_name](
-            sender_node_values)
-      else:
-        sender_node_values = self._node_transform_fn(sender_node_values)
-      broadcasted_sender_values = tfgnn.broadcast_node_to_edges(
-          graph,
-          edge_set_name,
-          tfgnn.reverse_tag(self._receiver_tag),
-          feature_value=sender_node_values)
-      pooled_sender_values = tfgnn.pool_edges_to_node(
-          graph,
-          edge_set_name,
-          self._receiver_tag,
-          "sum",
-          feature_value=broadcasted_sender_values)
-      pooled_node_states_list.append(pooled_sender_values)
-      if self._reduce_type == "mean":
-        edge_set_ones = tf.ones([edge_set.total_size, 1])
-        edge_set_in_degrees = tf.squeeze(
-            tfgnn.pool_edges_to_node(
-                graph,
-                edge_set_name,
-                self._receiver_tag,
-                "sum",
-                feature_value=edge_set_ones))
-        edge_set_in_degrees_list.append(edge_set_in_degrees)
-    total_size = graph.node_sets[node_set_name].total_size
+      sender_node_set_name = adjacency.node_set_name(self._sender_tag)
+      sender_node_values_list.append(graph.node_sets[sender_node_set_name][
+          self._sender_node_feature])
+      input_keys.append((sender_node_set_name, self._sender_node_feature))
+      sender_indices_list.append(adjacency[self._sender_tag])
+      receiver_indices_list.append(adjacency[self._receiver_tag])
     # aggregate with self node states only if add_self_loop is enabled.
     if self._add_self_loop:
-      self_node_values = graph.node_sets[node_set_name][self._self_node_feature]
-      self_node_values = self._dropout(self_node_values)
-      self_node_values = self._node_transform_fn(self_node_values)
-      pooled_node_states_list.append(self_node_values)
-      if self._reduce_type == "mean":
-        edge_set_in_degrees_list.append(tf.ones(total_size))
-    summed_node_values = tf.math.add_n(pooled_node_states_list)
+      self_node_values = node_set[self._self_node_feature]
+      input_keys.append((node_set_name, self._self_node_feature))
+    else:
+      self_node_values = None
+    if self._jit_compile:
+      sender_node_values_list, self_node_values = self._jit_transform_inputs(
+          sender_node_values_list, self_node_values, training=training,
+          input_keys=tuple(input_keys), name_scope=tf.get_current_name_scope())
+    else:
+      sender_node_values_list, self_node_values = self._transform_inputs(
+          sender_node_values_list, self_node_values, training=training,
+          input_keys=tuple(input_keys))
+
+    # All edge sets (and self loops, if any) are pooled together by a single
+    # gather from their concatenated node values, with indices offset into
+    # the respective node values, followed by a single segment sum. This is the
+    # same as tfgnn.broadcast_node_to_edges() followed by a "sum" of
+    # tfgnn.pool_edges_to_node() for each edge set, and adding up the results,
+    # but it does not need to concatenate the (usually larger) edge values.
+    node_values_list = list(sender_node_values_list)
+    if self._add_self_loop:
+      self_indices = tf.range(total_size, dtype=graph.indices_dtype)
+      node_values_list.append(self_node_values)
+      sender_indices_list.append(self_indices)
+      receiver_indices_list.append(self_indices)
+    offset = None
+    global_sender_indices_list = []
+    for node_values, sender_indices in zip(node_values_list,
+                                           sender_indices_list):
+      if offset is None:
+        global_sender_indices_list.append(sender_indices)
+        offset = tf.shape(node_values, out_type=sender_indices.dtype)[0]
+      else:
+        global_sender_indices_list.append(sender_indices + offset)
+        offset += tf.shape(node_values, out_type=sender_indices.dtype)[0]
+    receiver_indices = tf.concat(receiver_indices_list, axis=0)
+    edge_values = _gather_with_dense_gradient(
+        tf.concat(node_values_list, axis=0),
+        tf.concat(global_sender_indices_list, axis=0))
+    edge_values = tf.cast(edge_values, _accumulation_dtype(edge_values.dtype))
+    if self._sort_by_receiver:
+      segment_sum = _sorted_segment_sum
+    else:
+      segment_sum = tf.math.unsorted_segment_sum
+    summed_node_values = segment_sum(edge_values, receiver_indices, total_size)
+    if self._reduce_type == "mean":
+      in_degrees = tf.math.bincount(
+          receiver_indices, minlength=total_size, maxlength=total_size,
+          dtype=tf.float32)
+    else:
+      in_degrees = None
+    if self._jit_compile:
+      result = self._jit_combine(summed_node_values, in_degrees)
+    else:
+      result = self._combine(summed_node_values, in_degrees)
+    return {self._self_node_feature: result}
+
+  def _transform_inputs(self, sender_node_values_list, self_node_values, *,
+                        training, input_keys, name_scope=None):
+    """Returns the inputs after dropout and their linear transformations.
+
+    All transformations are applied in one function, so that the variables of
+    all of them get created on the first trace of `_jit_transform_inputs`.
+
+    Args:
+      sender_node_values_list: The sender node values, one per edge set in
+        the order of `self._edge_set_names`.
+      self_node_values: The node values of the receiver node set if
+        `add_self_loop` is enabled, or None otherwise.
+      training: Whether dropout is applied.
+      input_keys: For each of the sender node values and the self node values
+        (if any), the pair of node set name and feature name they come from.
+      name_scope: If set, the name scope to re-enter while creating variables.
+
+    Returns:
+      The pair of transformed `sender_node_values_list, self_node_values`.
+    """
+    with _reenter_name_scope(name_scope):
+      if self._share_weights:
+        return self._transform_inputs_with_shared_weights(
+            sender_node_values_list, self_node_values, training=training)
+      values_list = list(sender_node_values_list)
+      transform_fns = [self._transform_edge_fn_dict[edge_set_name]
+                       for edge_set_name in self._edge_set_names]
+      if self_node_values is not None:
+        values_list.append(self_node_values)
+        transform_fns.append(self._node_transform_fn)
+      transformed_list = self._transform_by_input_key(
+          values_list, transform_fns, input_keys, training=training)
+    if self_node_values is not None:
+      return transformed_list[:-1], transformed_list[-1]
+    return transformed_list, None
+
+  def _transform_by_input_key(self, values_list, transform_fns, input_keys, *,
+                              training):
+    """Returns the results of `transform_fns` on `values_list` after dropout.
+
+    Values with the same input key are the same, e.g., if several edge sets
+    start at the same node set. Unless they need separate dropout, they are
+    transformed by a single matmul with the concatenated kernels of all their
+    transformations.
+    """
+    positions_by_key = collections.defaultdict(list)
+    for position, input_key in enumerate(input_keys):
+      positions_by_key[input_key].append(position)
+    needs_dropout = self._dropout_rate and training is not False
+    transformed_list = [None] * len(values_list)
+    for positions in positions_by_key.values():
+      values = values_list[positions[0]]
+      dense_layers = [transform_fns[position] for position in positions]
+      if (len(positions) > 1 and not needs_dropout and values.shape.rank == 2
+          and all(dense.built for dense in dense_layers)):
+        kernel = tf.concat([dense.kernel for dense in dense_layers], axis=-1)
+        results = tf.split(tf.matmul(tf.cast(values, kernel.dtype), kernel),
+                           len(positions), axis=-1)
+      else:
+        # This also builds the transformations on their first use.
+        results = [
+            dense(self._dropout(values_list[position], training=training))
+            for dense, position in zip(dense_layers, positions)]
+      for position, result in zip(positions, results):
+        transformed_list[position] = result
+    return transformed_list
+
+  def _transform_inputs_with_shared_weights(self, sender_node_values_list,
+                                            self_node_values, *, training):
+    """Like `_transform_inputs()`, with one matmul for all inputs."""
+    values_list = list(sender_node_values_list)
+    if self_node_values is not None:
+      values_list.append(self_node_values)
+    if len(values_list) == 1:
+      values = values_list[0]
+    else:
+      values = tf.concat(values_list, axis=0)
+    transformed = self._node_transform_fn(
+        self._dropout(values, training=training))
+    if self._adds_bias_to_inputs():
+      # Right after the matmul, the bias add can be fused into it.
+      transformed = tf.nn.bias_add(transformed, self._bias_term)
+    if len(values_list) == 1:
+      transformed_list = [transformed]
+    else:
+      row_counts = [tf.shape(values)[0] for values in values_list]
+      transformed_list = tf.split(transformed, row_counts, axis=0)
+    if self_node_values is not None:
+      return transformed_list[:-1], transformed_list[-1]
+    return transformed_list, None
+
+  def _adds_bias_to_inputs(self) -> bool:
+    """Returns true if the bias is added before the reduce operation.
+
+    The mean of inputs that all have the bias added is the same as the mean of
+    the inputs plus the bias, provided there is at least one input, which the
+    self loop guarantees. With shared weights, this allows to add the bias
+    right after the single matmul of all inputs.
+    """
+    return (self._use_bias and self._share_weights and self._add_self_loop and
+            self._reduce_type == "mean")
+
+  def _combine(self, summed_node_values, in_degrees):
+    """Returns the new node states from the summed inputs."""
     if self._reduce_type == "mean":
-      total_in_degrees = tf.math.add_n(edge_set_in_degrees_list)
-      result = tf.math.divide_no_nan(summed_node_values,
-                                     total_in_degrees[:, tf.newaxis])
+      # A multiplication fuses more easily with the ops that follow.
+      result = summed_node_values * tf.math.reciprocal_no_nan(
+          in_degrees)[:, tf.newaxis]
     else:
       result = summed_node_values
-    if self._use_bias:
-      result += self._bias_term
+    result = tf.cast(result, self.compute_dtype)
+    if self._use_bias and not self._adds_bias_to_inputs():
+      result = tf.nn.bias_add(result, self._bias_term)
     result = self._activation(result)
-    return {self._self_node_feature: result}
+    return result
+
+  _jit_transform_inputs = tf.function(_transform_inputs, jit_compile=True,
+                                      reduce_retracing=True)
+  _jit_combine = tf.function(_combine, jit_compile=True,
+                             reduce_retracing=True)
 
 
 @tf.keras.utils.register_keras_serializable(package="GraphSAGE")
@@ -496,6 +822,8 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
     combine_type: str = "sum",
     activation: Union[str, Callable[..., Any]] = "relu",
     feature_name: str = tfgnn.HIDDEN_STATE,
+    jit_compile: bool = False,
+    dropout_before_broadcast: bool = False,
     name: str = "graph_sage",
     **kwargs) -> tf.keras.layers.Layer:
   """Returns a GraphSAGE GraphUpdater layer for nodes in node_set_names.
@@ -539,10 +867,22 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
       `tf.keras.layers.Activation()`. Defaults to relu.
     feature_name: The feature name of node states; defaults to
       `tfgnn.HIDDEN_STATE`.
+    jit_compile: Can be set to true to compile parts of the computation with
+      XLA, as for `graph_sage.GraphSAGEPoolingConv` (if used) and
+      `graph_sage.GraphSAGENextState`, see there.
+    dropout_before_broadcast: Can be set to true to apply dropout to sender
+      node features before they are broadcast to edges, as for
+      `graph_sage.GraphSAGEPoolingConv` or `graph_sage.GraphSAGEAggregatorConv`,
+      see there.
     name: Optionally, a name for the layer returned.
     **kwargs: Any optional arguments to `graph_sage.GraphSAGEPoolingConv`,
       `graph_sage.GraphSAGEAggregatorConv` or `graph_sage.GraphSAGENextState`,
       see there.
+
+  Returns:
+    A GraphUpdate layer. Its sublayers are created on the first call, for the
+    edge sets and node sets of the GraphTensorSpec of that input, and are
+    reused (with their weights) by all later calls.
   """
   if use_pooling != (hidden_units is not None):
     raise ValueError(
@@ -560,6 +900,8 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
           hidden_units=hidden_units,
           use_bias=use_bias,
           dropout_rate=dropout_rate,
+          jit_compile=jit_compile,
+          dropout_before_broadcast=dropout_before_broadcast,
           **kwargs)
     else:
       return GraphSAGEAggregatorConv(
@@ -568,6 +910,7 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
           sender_node_feature=feature_name,
           units=units,
           dropout_rate=dropout_rate,
+          dropout_before_broadcast=dropout_before_broadcast,
           **kwargs)
 
   def nodes_next_state_factory(node_set_name):
@@ -580,6 +923,7 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
         l2_normalize=l2_normalize,
         combine_type=combine_type,
         activation=activation,
+        jit_compile=jit_compile,
         **kwargs)
 
   def node_set_update_factory(node_set_name, edge_set_inputs, next_state):
@@ -597,6 +941,52 @@ def GraphSAGEGraphUpdate(  # To be called like a class initializer.  pylint: dis
   return gnn_builder.Convolve(node_set_names, name=name)
 
 
+def _bias_activation_l2_normalize(
+    values: tf.Tensor, bias: Optional[tf.Tensor], *,
+    activation: Callable[..., Any], l2_normalize: bool) -> tf.Tensor:
+  """Returns `values` with bias, activation and L2 normalization applied.
+
+  These elementwise ops and the reduction for the norm all read the same
+  [num_nodes, units] tensor. Keeping them together lets XLA (if enabled) fuse
+  them into one pass over it.
+
+  Args:
+    values: The combined node states, with shape [num_nodes, units].
+    bias: Optionally, a bias to add to each row of `values`.
+    activation: The nonlinearity applied after the bias.
+    l2_normalize: If true, each row of the result is scaled to unit L2 norm,
+      as by `tf.math.l2_normalize(..., axis=1)`.
+
+  Returns:
+    The new node states.
+  """
+  if bias is not None:
+    values = tf.nn.bias_add(values, bias)
+  values = activation(values)
+  if l2_normalize:
+    values = _l2_normalize_rows(values)
+  return values
+
+
+def _l2_normalize_rows(values: tf.Tensor, epsilon: float = 1e-12) -> tf.Tensor:
+  """Returns `tf.math.l2_normalize(values, axis=1)`, accumulating in float32.
+
+  The squares are summed up in float32 also for 16-bit `values`, and the sum
+  is turned into a multiplier with a single rsqrt.
+
+  Args:
+    values: A tensor of rank 2 or more.
+    epsilon: A lower bound for the squared norm, as for `tf.math.l2_normalize`.
+
+  Returns:
+    `values` with each row scaled to unit L2 norm, in the dtype of `values`.
+  """
+  accumulated = tf.cast(values, _accumulation_dtype(values.dtype))
+  square_sum = tf.reduce_sum(tf.square(accumulated), axis=1, keepdims=True)
+  inv_norm = tf.math.rsqrt(tf.maximum(square_sum, epsilon))
+  return tf.cast(accumulated * inv_norm, values.dtype)
+
+
 @tf.keras.utils.register_keras_serializable(package="GraphSAGE")
 class GraphSAGENextState(tf.keras.layers.Layer):
   r"""GraphSAGENextState: compute new node states with GraphSAGE algorithm.
@@ -625,6 +1015,11 @@ class GraphSAGENextState(tf.keras.layers.Layer):
   The `units=...` parameter of the next-state layer and all convolutions must be
   equal, unless `combine_type="concat"`is set.
 
+  The edge inputs are combined in the order of their sorted keys. A caller
+  with many edge sets can also combine them ahead of time (by summation or by
+  concatenation in sorted key order, respectively) and pass the result as a
+  single edge input, which saves this layer one input per edge set.
+
   GraphSAGE is Algorithm 1 in Hamilton et al.: ["Inductive Representation
   Learning on Large Graphs"](https://arxiv.org/abs/1706.02216), 2017.
   It computes the new hidden state h_v for each node v from a concatenation of
@@ -653,6 +1048,10 @@ class GraphSAGENextState(tf.keras.layers.Layer):
     * a bias term added just before the final nonlinearity;
     * a configurable combine_type (originally "sum");
     * additional options to influence normalization, activation, etc.
+
+  Under a mixed precision policy like "mixed_bfloat16", the weights are kept
+  in float32 but the new node states are computed in 16 bits, except for the
+  sum of squares in the L2 normalization, which is done in float32.
   """
 
   def __init__(self,
@@ -664,6 +1063,7 @@ class GraphSAGENextState(tf.keras.layers.Layer):
                l2_normalize: bool = True,
                combine_type: str = "sum",
                activation: Union[str, Callable[..., Any]] = "relu",
+               jit_compile: bool = False,
                **kwargs):
     """Initializes the GraphSAGENextState layer.
 
@@ -687,18 +1087,34 @@ class GraphSAGENextState(tf.keras.layers.Layer):
         state and aggregated sender node features. This can be specified as a
         Keras layer, a tf.keras.activations.* function, or a string understood
         by `tf.keras.layers.Activation()`. Defaults to relu.
+      jit_compile: If true, the computation of the new node states from the
+        inputs (dropout, transformation, combination, bias, activation and
+        normalization) is compiled with XLA (as by
+        `tf.function(jit_compile=True)`), which allows to fuse them into fewer
+        kernels. Unlike XLA auto-clustering (`tf.config.optimizer.set_jit()`),
+        this also takes effect on CPU, without setting the global flag
+        `TF_XLA_FLAGS=--tf_xla_cpu_global_jit`, and it is confined to this
+        layer. Defaults to false, because not all platforms benefit from XLA.
       **kwargs: Forwarded to the base class tf.keras.layers.Layer.
     """
     super().__init__(**kwargs)
     self._use_bias = use_bias
     self._l2_normalize = l2_normalize
+    if combine_type not in ("sum", "concat"):
+      raise ValueError(
+          f"combine_type: {combine_type} isn't supported. Please"
+          " instead specify 'concat' or 'sum'.")
     self._combine_type = combine_type
     self._activation = tf.keras.activations.get(activation)
     self._units = units
     self._self_transform = tf.keras.layers.Dense(units, use_bias=False)
     self._feature_name = feature_name
     self._dropout_rate = dropout_rate
-    self._dropout = tf.keras.layers.Dropout(self._dropout_rate)
+    if self._dropout_rate:
+      self._dropout = tf.keras.layers.Dropout(self._dropout_rate)
+    else:
+      self._dropout = None  # Skip the no-op.
+    self._jit_compile = jit_compile
 
   def get_config(self):
     """Returns the config for GraphSAGENextState."""
@@ -709,29 +1125,31 @@ class GraphSAGENextState(tf.keras.layers.Layer):
         feature_name=self._feature_name,
         l2_normalize=self._l2_normalize,
         combine_type=self._combine_type,
-        activation=self._activation,
+        activation=_serialize_activation(self._activation),
+        jit_compile=self._jit_compile,
         **super().get_config())
 
   def build(self, input_shapes):
     """Creates the bias_term based on input shapes."""
     _, edge_inputs_shape_dict, _ = input_shapes
+    # The edge inputs are combined in the order of their sorted keys.
+    self._edge_input_keys = tuple(sorted(edge_inputs_shape_dict.keys()))
+    self._edge_input_key_set = frozenset(self._edge_input_keys)
     if self._use_bias:
+      # The combine_type has been validated by __init__. Only "concat" needs
+      # the (static) widths of the edge inputs.
       if self._combine_type == "sum":
-        shape = self._units
-      elif self._combine_type == "concat":
+        shape = (self._units,)
+      else:
         edge_input_shapes = list(edge_inputs_shape_dict.values())
         if any(s.rank != 2 or s[1] is None for s in edge_input_shapes):
           raise ValueError("Invalid shape for edge inputs.")
-        shape = self._units + sum(s[1] for s in edge_input_shapes)
-      else:
-        raise ValueError(
-            f"combine_type: {self._combine_type} isn't supported. Please"
-            " instead specify 'concat' or 'sum'.")
+        shape = (self._units + sum(int(s[1]) for s in edge_input_shapes),)
       self._bias_term = self.add_weight(
           name="bias",
-          shape=[shape],
+          shape=shape,
           trainable=True,
-          initializer=tf.keras.initializers.Zeros())
+          initializer="zeros")
 
   def call(self, inputs, training):
     """Calls the layer on inputs and returns node feature tensors."""
@@ -739,13 +1157,54 @@ class GraphSAGENextState(tf.keras.layers.Layer):
     if unused_context_state:
       raise ValueError(
           "Input from context is not supported by GraphSAGENextState")
-    result = self._dropout(old_node_state, training=training)
-    result = self._self_transform(result)
-    result = [result, *[v for _, v in sorted(edge_inputs_dict.items())]]
-    result = tfgnn.combine_values(result, self._combine_type)
-    if self._use_bias:
-      result += self._bias_term
-    result = self._activation(result)
-    if self._l2_normalize:
-      result = tf.math.l2_normalize(result, axis=1)
+    if edge_inputs_dict.keys() != self._edge_input_key_set:
+      raise ValueError(
+          f"GraphSAGENextState was built for edge inputs "
+          f"{list(self._edge_input_keys)} but called with "
+          f"{sorted(edge_inputs_dict.keys())}")
+    edge_inputs = [edge_inputs_dict[key] for key in self._edge_input_keys]
+    if self._jit_compile:
+      result = self._jit_call_impl(old_node_state, edge_inputs,
+                                   training=training,
+                                   name_scope=tf.get_current_name_scope())
+    else:
+      result = self._call_impl(old_node_state, edge_inputs, training=training)
     return {self._feature_name: result}
+
+  def _call_impl(self, old_node_state, edge_inputs, *, training,
+                 name_scope=None):
+    """Returns the new node state from the old one and the edge inputs.
+
+    With `jit_compile=True`, this is called as `_jit_call_impl`. Like all
+    `tf.function`s in this file, it is traced with `reduce_retracing=True`:
+    the number of nodes changes between batches of graphs, so after seeing
+    a second size, the function is retraced once for unknown sizes instead
+    of once for every size.
+    """
+    with _reenter_name_scope(name_scope):
+      result = old_node_state
+      if self._dropout is not None:
+        result = self._dropout(result, training=training)
+      result = self._self_transform(result)
+    bias = self._bias_term if self._use_bias else None
+    if bias is not None and self._combine_type == "sum":
+      # Adding the bias to one summand is the same as adding it to the sum,
+      # and right after the matmul, the bias add can be fused into it.
+      result = tf.nn.bias_add(result, bias)
+      bias = None
+    # The combine_type and the number of edge inputs are resolved at trace
+    # time, so each case traces to a single op that XLA (if enabled) can fuse
+    # with what follows.
+    if self._combine_type == "sum":
+      if len(edge_inputs) == 1:  # Common for a single edge set.
+        result = tf.math.add(result, edge_inputs[0])
+      else:
+        result = tf.math.add_n([result, *edge_inputs])
+    else:
+      result = tf.concat([result, *edge_inputs], axis=-1)
+    return _bias_activation_l2_normalize(
+        result, bias,
+        activation=self._activation, l2_normalize=self._l2_normalize)
+
+  _jit_call_impl = tf.function(_call_impl, jit_compile=True,
+                               reduce_retracing=True)
@@ -13,6 +13,7 @@
 # limitations under the License.
 # ==============================================================================
 import math
+import os
 
 from absl.testing import parameterized
 import tensorflow as tf
@@ -28,6 +29,15 @@ if not tf.__version__.startswith("2.20."):  # TODO: b/441006328 - Remove this.
 _FEATURE_NAME = "f"
 
 
+def _double(x):
+  return 2. * x
+
+
+@tf.keras.utils.register_keras_serializable(package="GraphSAGETest")
+def _registered_double(x):
+  return 2. * x
+
+
 def _get_test_graph():
   graph = tfgnn.GraphTensor.from_pieces(
       context=tfgnn.Context.from_fields(
@@ -91,12 +101,25 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
 
   def setUp(self):
     super().setUp()
+    # tf.test.TestCase neglects to reset this between tests.
+    tf.keras.mixed_precision.set_global_policy("float32")
     tfgnn.enable_graph_tensor_validation_at_runtime()
 
   @parameterized.named_parameters(("MaxPooling", "max"),
                                   ("MaxNoInfPooling", "max_no_inf"),
-                                  ("MeanPooling", "mean"))
-  def testPooling(self, reduce_type):
+                                  ("MeanPooling", "mean"),
+                                  ("MeanPoolingJitCompiled", "mean", True),
+                                  ("MeanPoolingMBF16", "mean", False,
+                                   "mixed_bfloat16"),
+                                  ("MaxPoolingDropoutBeforeBroadcast", "max",
+                                   False, None, True),
+                                  ("MeanPoolingDropoutBeforeBroadcastJit",
+                                   "mean", True, None, True))
+  def testPooling(self, reduce_type, jit_compile=False,
+                  mixed_precision_policy_name=None,
+                  dropout_before_broadcast=False):
+    if mixed_precision_policy_name:
+      tf.keras.mixed_precision.set_global_policy(mixed_precision_policy_name)
     graph = _get_test_graph()
     out_units = 1
     conv = graph_sage.GraphSAGEPoolingConv(
@@ -104,7 +127,9 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
         sender_node_feature=_FEATURE_NAME,
         units=out_units,
         hidden_units=out_units,
-        reduce_type=reduce_type)
+        reduce_type=reduce_type,
+        jit_compile=jit_compile,
+        dropout_before_broadcast=dropout_before_broadcast)
     _ = conv(graph, edge_set_name="written")  # Build weights.
     weights = {v.name: v for v in conv.trainable_weights}
     self.assertLen(weights, 3)
@@ -138,7 +163,8 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
                 [6.]
             ])
     }
-    self.assertAllEqual(expected_output_dict[reduce_type], actual)
+    self.assertAllEqual(
+        tf.cast(expected_output_dict[reduce_type], actual.dtype), actual)
 
   def testMeanAggregation(self):
     graph = _get_test_graph()
@@ -162,6 +188,212 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
     ])
     self.assertAllEqual(expected_output, actual)
 
+  @parameterized.named_parameters(
+      ("Sum", "sum", [[5., 5.]]),
+      ("SumJitCompiled", "sum", [[5., 5.]], True),
+      ("Concat", "concat", [[2., 1., 4., 3.]]),
+      ("SumMBF16", "sum", [[5., 5.]], False, "mixed_bfloat16"),
+      ("SumJitCompiledMBF16", "sum", [[5., 5.]], True, "mixed_bfloat16"),
+      ("ConcatMF16", "concat", [[2., 1., 4., 3.]], False, "mixed_float16"))
+  def testNextStateBias(self, combine_type, expected, jit_compile=False,
+                        policy="float32"):
+    tf.keras.mixed_precision.set_global_policy(policy)
+    compute_dtype = tf.keras.mixed_precision.global_policy().compute_dtype
+    next_state = graph_sage.GraphSAGENextState(
+        units=2, combine_type=combine_type, activation="linear",
+        l2_normalize=False, jit_compile=jit_compile)
+    inputs = (tf.constant([[1., 2.]]),
+              {"a": tf.constant([[3., 4.]], compute_dtype)}, {})
+    _ = next_state(inputs)  # Build weights.
+    weights = {v.name: v for v in next_state.trainable_weights}
+    self.assertLen(weights, 2)
+    for weight in weights.values():
+      self.assertEqual(tf.float32, weight.dtype)
+    weights["graph_sage_next_state/dense/kernel:0"].assign(tf.eye(2))
+    bias = {"sum": [1., -1.], "concat": [1., -1., 1., -1.]}[combine_type]
+    weights["graph_sage_next_state/bias:0"].assign(bias)
+    actual = next_state(inputs)["hidden_state"]
+    self.assertEqual(compute_dtype, actual.dtype)
+    self.assertAllEqual(expected, tf.cast(actual, tf.float32))
+
+  @parameterized.named_parameters(("Sum", "sum"), ("Concat", "concat"))
+  def testNextStatePreCombinedEdgeInputs(self, combine_type):
+    node_state = tf.constant([[1., 2.], [3., 4.]])
+    edge_inputs = {"b": tf.constant([[1., 1.], [2., -2.]]),
+                   "a": tf.constant([[0., 5.], [-1., 1.]])}
+    pre_combined = tfgnn.combine_values(
+        [edge_inputs["a"], edge_inputs["b"]], combine_type)
+    next_state = graph_sage.GraphSAGENextState(
+        units=2, combine_type=combine_type)
+    expected = next_state((node_state, edge_inputs, {}))["hidden_state"]
+    next_state_pre_combined = graph_sage.GraphSAGENextState(
+        units=2, combine_type=combine_type)
+    _ = next_state_pre_combined((node_state, {"ab": pre_combined}, {}))
+    next_state_pre_combined.set_weights(next_state.get_weights())
+    self.assertAllClose(
+        expected,
+        next_state_pre_combined((node_state, {"ab": pre_combined},
+                                 {}))["hidden_state"])
+
+  def testNextStateEdgeInputsMismatch(self):
+    next_state = graph_sage.GraphSAGENextState(units=2)
+    node_state = tf.constant([[1., 2.]])
+    edge_input = tf.constant([[3., 4.]])
+    _ = next_state((node_state, {"a": edge_input, "b": edge_input}, {}))
+    self.assertRaisesRegex(
+        ValueError,
+        r"built for edge inputs \['a', 'b'\] but called with \['a', 'c'\]",
+        lambda: next_state((node_state, {"a": edge_input, "c": edge_input},
+                            {})))
+
+  @parameterized.named_parameters(
+      ("Name", "relu", "relu"),
+      ("Function", tf.nn.elu, "elu"))
+  def testNextStateConfigActivation(self, activation, expected):
+    next_state = graph_sage.GraphSAGENextState(units=2, activation=activation)
+    config = next_state.get_config()
+    self.assertEqual(expected, config["activation"])
+    restored = graph_sage.GraphSAGENextState.from_config(config)
+    self.assertIs(tf.keras.activations.get(expected), restored._activation)
+
+  def testNextStateJitCompiledRetracing(self):
+    next_state = graph_sage.GraphSAGENextState(units=2, jit_compile=True)
+    def call_and_count_traces(num_nodes):
+      _ = next_state((tf.ones([num_nodes, 4]),
+                      {"a": tf.ones([num_nodes, 2])}, {}))
+      return next_state._jit_call_impl.experimental_get_tracing_count()
+    _ = call_and_count_traces(3)
+    tracing_count = call_and_count_traces(5)
+    # Further node set sizes do not need a new trace.
+    self.assertEqual(tracing_count, call_and_count_traces(7))
+    self.assertEqual(tracing_count, call_and_count_traces(9))
+
+  @parameterized.named_parameters(("", False), ("JitCompiled", True))
+  def testNextStateExport(self, jit_compile):
+    inputs = (tf.constant([[1., 2.], [3., 4.]]),
+              {"a": tf.constant([[0.5, 1.], [-1., 2.]])}, {})
+    next_state = graph_sage.GraphSAGENextState(units=2,
+                                               jit_compile=jit_compile)
+    export_dir = os.path.join(self.get_temp_dir(), "next-state")
+    tfgnn.keras.layers.export_next_state(next_state, inputs, export_dir)
+    loaded = tf.saved_model.load(export_dir)
+    self.assertAllClose(next_state(inputs)["hidden_state"],
+                        loaded.serve(inputs)["hidden_state"])
+
+  @parameterized.named_parameters(
+      ("Function", _double),
+      ("Lambda", lambda x: 2. * x))
+  def testNextStateConfigCustomActivation(self, activation):
+    next_state = graph_sage.GraphSAGENextState(units=2, activation=activation)
+    config = next_state.get_config()
+    self.assertIs(activation, config["activation"])
+    restored = graph_sage.GraphSAGENextState.from_config(config)
+    self.assertIs(activation, restored._activation)
+
+  def testNextStateConfigRegisteredActivation(self):
+    next_state = graph_sage.GraphSAGENextState(units=2,
+                                               activation=_registered_double)
+    config = next_state.get_config()
+    self.assertIsInstance(config["activation"], dict)
+    restored = graph_sage.GraphSAGENextState.from_config(config)
+    self.assertIs(_registered_double, restored._activation)
+
+  def testNextStateActivationFromCustomObjectScope(self):
+    with tf.keras.utils.custom_object_scope({"my_activation": _double}):
+      next_state = graph_sage.GraphSAGENextState(units=2,
+                                                 activation="my_activation")
+    self.assertIs(_double, next_state._activation)
+    with tf.keras.utils.custom_object_scope({"my_activation": tf.nn.relu}):
+      next_state = graph_sage.GraphSAGENextState(units=2,
+                                                 activation="my_activation")
+    self.assertIs(tf.nn.relu, next_state._activation)
+
+  def testNextStateCombineTypeFail(self):
+    self.assertRaisesRegex(
+        ValueError, r"combine_type: mean isn't supported",
+        lambda: graph_sage.GraphSAGENextState(units=2, combine_type="mean"))
+
+  @parameterized.named_parameters(
+      ("TransformBeforeBroadcastMF16", 4, "mixed_float16"),
+      ("TransformBeforeBroadcastMBF16", 4, "mixed_bfloat16"),
+      ("TransformAfterPoolingMF16", 2, "mixed_float16"),
+      ("TransformAfterPoolingMBF16", 2, "mixed_bfloat16"))
+  def testAggregatorMixedPrecision(self, node_dims, policy):
+    # A single receiver node with many edges, so that a sum in 16 bits would
+    # get stuck when adding 1s (at 256 for bfloat16, 2048 for float16).
+    num_edges = 3000
+    graph = tfgnn.GraphTensor.from_pieces(
+        node_sets={
+            "node": tfgnn.NodeSet.from_fields(
+                sizes=tf.constant([1]),
+                features={_FEATURE_NAME: tf.ones([1, node_dims])})},
+        edge_sets={
+            "edge": tfgnn.EdgeSet.from_fields(
+                sizes=tf.constant([num_edges]),
+                adjacency=tfgnn.Adjacency.from_indices(
+                    ("node", tf.zeros([num_edges], tf.int32)),
+                    ("node", tf.zeros([num_edges], tf.int32))))})
+    # With units=2, node_dims=4 lets the transformation move before the
+    # broadcast, node_dims=2 keeps it after the pooling.
+    tf.keras.mixed_precision.set_global_policy(policy)
+    conv = graph_sage.GraphSAGEAggregatorConv(
+        receiver_tag=tfgnn.TARGET,
+        sender_node_feature=_FEATURE_NAME,
+        units=2,
+        reduce_type="sum")
+    _ = conv(graph, edge_set_name="edge")  # Build weights.
+    conv.trainable_weights[0].assign(tf.eye(node_dims, 2))
+    actual = conv(graph, edge_set_name="edge")
+    self.assertEqual(conv.compute_dtype, actual.dtype)
+    self.assertAllClose([[num_edges, num_edges]], tf.cast(actual, tf.float32),
+                        rtol=1e-2)
+
+  @parameterized.named_parameters(("Aggregator", False), ("Pooling", True))
+  def testDropoutBeforeBroadcast(self, use_pooling):
+    tf.random.set_seed(0)
+    # A single node with two edges to itself.
+    node_dims = 20
+    graph = tfgnn.GraphTensor.from_pieces(
+        node_sets={
+            "node": tfgnn.NodeSet.from_fields(
+                sizes=tf.constant([1]),
+                features={_FEATURE_NAME: tf.ones([1, node_dims])})},
+        edge_sets={
+            "edge": tfgnn.EdgeSet.from_fields(
+                sizes=tf.constant([2]),
+                adjacency=tfgnn.Adjacency.from_indices(
+                    ("node", tf.constant([0, 0])),
+                    ("node", tf.constant([0, 0]))))})
+    if use_pooling:
+      conv = graph_sage.GraphSAGEPoolingConv(
+          receiver_tag=tfgnn.TARGET,
+          sender_node_feature=_FEATURE_NAME,
+          units=node_dims,
+          hidden_units=node_dims,
+          reduce_type="sum",
+          use_bias=False,
+          activation="linear",
+          dropout_rate=0.5,
+          dropout_before_broadcast=True)
+    else:
+      conv = graph_sage.GraphSAGEAggregatorConv(
+          receiver_tag=tfgnn.TARGET,
+          sender_node_feature=_FEATURE_NAME,
+          units=node_dims,
+          reduce_type="sum",
+          dropout_rate=0.5,
+          dropout_before_broadcast=True)
+    _ = conv(graph, edge_set_name="edge")  # Build weights.
+    for weight in conv.trainable_weights:
+      weight.assign(tf.eye(node_dims))
+
+    # Both edges share the dropout mask of their sender node, so each output
+    # is either 0 or 2 * 1/(1-0.5) = 4, but never the 2 from a single edge.
+    actual = conv(graph, edge_set_name="edge", training=True)
+    self.assertAllInSet(actual, [0., 4.])
+    self.assertAllEqual(conv(graph, edge_set_name="edge", training=False),
+                        [[2.] * node_dims])
+
   @parameterized.named_parameters(
       ("NoDropoutMeanAggKeras", 0.0, tftu.ModelReloading.KERAS),
       ("NoDropoutMeanAggSavedModel", 0.0, tftu.ModelReloading.SAVED_MODEL),
@@ -220,6 +452,29 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
       self.assertAllClose(min_max(topic_node_vectors[0]), [0., 10.])
       self.assertAllClose(min_max(topic_node_vectors[1]), [0., 10.])
 
+  @parameterized.named_parameters(("Aggregator", False), ("Pooling", True))
+  def testGraphUpdateDropoutBeforeBroadcast(self, use_pooling):
+    graph = _get_test_graph()
+    layer = graph_sage.GraphSAGEGraphUpdate(
+        node_set_names={"author"},
+        receiver_tag=tfgnn.TARGET,
+        use_pooling=use_pooling,
+        units=3,
+        hidden_units=3 if use_pooling else None,
+        dropout_rate=0.5,
+        dropout_before_broadcast=True,
+        feature_name=_FEATURE_NAME)
+    for training in [True, False]:
+      actual = layer(graph, training=training)
+      self.assertEqual([4, 3],
+                       actual.node_sets["author"][_FEATURE_NAME].shape)
+    conv_type = (graph_sage.GraphSAGEPoolingConv if use_pooling
+                 else graph_sage.GraphSAGEAggregatorConv)
+    convs = [m for m in layer.submodules if isinstance(m, conv_type)]
+    self.assertLen(convs, 2)  # For edge sets "written" and "affiliated_with".
+    for conv in convs:
+      self.assertTrue(conv.get_config()["dropout_before_broadcast"])
+
   def testAllNodeSets(self):
     graph = _get_test_graph()
     layer = graph_sage.GraphSAGEGraphUpdate(
@@ -253,9 +508,16 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
       ("E2ELoadSavedModelPooling", True, "concat", True,
        tftu.ModelReloading.SAVED_MODEL),
       ("E2ELoadSavedModelAgg", True, "concat", False,
-       tftu.ModelReloading.SAVED_MODEL))
+       tftu.ModelReloading.SAVED_MODEL),
+      ("E2ELoadKerasPoolingJitCompiled", True, "concat", True,
+       tftu.ModelReloading.KERAS, True),
+      ("E2ELoadKerasNoConcatAggJitCompiled", True, "sum", False,
+       tftu.ModelReloading.KERAS, True),
+      ("E2ELoadSavedModelAggJitCompiled", True, "concat", False,
+       tftu.ModelReloading.SAVED_MODEL, True))
   def testFullModel(self, normalize, combine_type, use_pooling,
-                    model_reloading=tftu.ModelReloading.SKIP):
+                    model_reloading=tftu.ModelReloading.SKIP,
+                    jit_compile=False):
     graph = _get_test_graph()
     out_units = 1
     layer = graph_sage.GraphSAGEGraphUpdate(
@@ -267,7 +529,8 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
         hidden_units=out_units if use_pooling else None,
         l2_normalize=normalize,
         combine_type=combine_type,
-        feature_name=_FEATURE_NAME)
+        feature_name=_FEATURE_NAME,
+        jit_compile=jit_compile)
     _ = layer(graph)
     weights = {v.name: v for v in layer.trainable_weights}
     if use_pooling:
@@ -479,8 +742,14 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
 
   @parameterized.named_parameters(
       ("E2ELoadKerasGCNConv", tftu.ModelReloading.KERAS),
-      ("E2ELoadSavedModelGCNConv", tftu.ModelReloading.SAVED_MODEL))
-  def testGCNConvolutionModelLoad(self, model_reloading):
+      ("E2ELoadSavedModelGCNConv", tftu.ModelReloading.SAVED_MODEL),
+      ("E2ELoadKerasGCNConvJitCompiled", tftu.ModelReloading.KERAS, True),
+      ("E2ELoadSavedModelGCNConvJitCompiled",
+       tftu.ModelReloading.SAVED_MODEL, True),
+      ("E2ELoadKerasGCNConvSortByReceiver",
+       tftu.ModelReloading.KERAS, False, True))
+  def testGCNConvolutionModelLoad(self, model_reloading, jit_compile=False,
+                                  sort_by_receiver=False):
     graph = _get_test_graph()
     message_units = 1
     conv = graph_sage.GCNGraphSAGENodeSetUpdate(
@@ -489,7 +758,9 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
         self_node_feature=_FEATURE_NAME,
         sender_node_feature=_FEATURE_NAME,
         units=message_units,
-        use_bias=True)
+        use_bias=True,
+        jit_compile=jit_compile,
+        sort_by_receiver=sort_by_receiver)
     layer = tfgnn.keras.layers.GraphUpdate(node_sets={"author": conv})
     _ = layer(graph)  # Build weights.
     weights = {v.name: v for v in layer.trainable_weights}
@@ -513,10 +784,21 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
     actual = actual_graph.node_sets["author"]
     expected_output = tf.constant([[4.3333335], [4.6666665], [3.5],
                                    [4.6666665]])
-    self.assertAllEqual(expected_output, actual[_FEATURE_NAME])
+    self.assertAllClose(expected_output, actual[_FEATURE_NAME])
 
-  @parameterized.named_parameters(("WithSelfLoop", True), ("NoSelfLoop", False))
-  def testGCNConvolutionSharedWeights(self, add_self_loop):
+  @parameterized.named_parameters(
+      ("WithSelfLoop", True), ("NoSelfLoop", False),
+      ("WithSelfLoopJitCompiled", True, True),
+      ("WithSelfLoopMF16", True, False, "mixed_float16"),
+      ("WithSelfLoopMBF16", True, False, "mixed_bfloat16"),
+      ("WithSelfLoopBias", True, False, None, 1.),
+      ("WithSelfLoopBiasJitCompiled", True, True, None, 1.),
+      ("NoSelfLoopBias", False, False, None, 1.))
+  def testGCNConvolutionSharedWeights(self, add_self_loop, jit_compile=False,
+                                      mixed_precision_policy_name=None,
+                                      bias=0.):
+    if mixed_precision_policy_name:
+      tf.keras.mixed_precision.set_global_policy(mixed_precision_policy_name)
     graph = _get_test_graph()
     message_units = 1
     conv = graph_sage.GCNGraphSAGENodeSetUpdate(
@@ -527,20 +809,142 @@ class GraphsageTest(tf.test.TestCase, parameterized.TestCase):
         units=message_units,
         use_bias=True,
         share_weights=True,
-        add_self_loop=add_self_loop)
+        add_self_loop=add_self_loop,
+        jit_compile=jit_compile)
     _ = conv(graph, node_set_name="topic")  # Build weights.
     weights = {v.name: v for v in conv.trainable_weights}
     self.assertLen(weights, 2)
     topic_feature_dim = 30
     weights["graph_sage_gcn_update/dense/kernel:0"].assign([[1.0]] *
                                                            topic_feature_dim)
-    weights["bias:0"].assign([0.] * message_units)
+    weights["bias:0"].assign([bias] * message_units)
     actual = conv(graph, node_set_name="topic")
     expected_output = {
         True: tf.constant([[30.], [15.]]),
         False: tf.constant([[0.], [30.]])
     }
-    self.assertAllEqual(expected_output[add_self_loop], actual[_FEATURE_NAME])
+    self.assertAllEqual(
+        tf.cast(expected_output[add_self_loop] + bias, conv.compute_dtype),
+        actual[_FEATURE_NAME])
+
+  @parameterized.named_parameters(("", False), ("JitCompiled", True))
+  def testGCNConvolutionMeanMatchesDivision(self, jit_compile):
+    conv = graph_sage.GCNGraphSAGENodeSetUpdate(
+        edge_set_names=["edge"],
+        receiver_tag=tfgnn.TARGET,
+        units=3,
+        activation="linear",
+        use_bias=False,
+        jit_compile=jit_compile)
+    summed_node_values = tf.random.stateless_uniform(
+        [6, 3], seed=[1, 2], minval=-1e3, maxval=1e3)
+    in_degrees = tf.constant([0., 1., 3., 7., 49., 1e5])
+    combine = conv._jit_combine if jit_compile else conv._combine
+    actual = combine(summed_node_values, in_degrees)
+    # The mean used to be computed by a division. Multiplying with the
+    # reciprocal rounds twice, so results may differ in the last bits.
+    expected = tf.math.divide_no_nan(summed_node_values,
+                                     in_degrees[:, tf.newaxis])
+    self.assertAllClose(expected, actual, rtol=3e-7, atol=0.)
+    self.assertAllEqual([0., 0., 0.], actual[0])
+
+  @parameterized.named_parameters(("WithSelfLoop", True), ("NoSelfLoop", False))
+  def testGCNConvolutionSingleReceiver(self, add_self_loop):
+    graph = tfgnn.GraphTensor.from_pieces(
+        node_sets={
+            "node": tfgnn.NodeSet.from_fields(
+                sizes=tf.constant([1]),
+                features={_FEATURE_NAME: tf.constant([[1., 2.]])})},
+        edge_sets={
+            "edge": tfgnn.EdgeSet.from_fields(
+                sizes=tf.constant([2]),
+                adjacency=tfgnn.Adjacency.from_indices(
+                    ("node", tf.constant([0, 0])),
+                    ("node", tf.constant([0, 0]))))})
+    conv = graph_sage.GCNGraphSAGENodeSetUpdate(
+        edge_set_names=["edge"],
+        receiver_tag=tfgnn.TARGET,
+        self_node_feature=_FEATURE_NAME,
+        sender_node_feature=_FEATURE_NAME,
+        units=1,
+        use_bias=False,
+        share_weights=True,
+        add_self_loop=add_self_loop)
+    _ = conv(graph, node_set_name="node")  # Build weights.
+    conv.trainable_weights[0].assign([[1.0], [1.0]])
+    actual = conv(graph, node_set_name="node")
+    self.assertAllClose(tf.constant([[3.]]), actual[_FEATURE_NAME])
+
+  @parameterized.named_parameters(("", False), ("JitCompiled", True))
+  def testGCNConvolutionSameSenderNodeSet(self, jit_compile):
+    # Edge sets "x" and "y" both go from node set "a" to node set "b".
+    def edge_set(source, target):
+      return tfgnn.EdgeSet.from_fields(
+          sizes=tf.constant([len(source)]),
+          adjacency=tfgnn.Adjacency.from_indices(
+              ("a", tf.constant(source)), ("b", tf.constant(target))))
+    graph = tfgnn.GraphTensor.from_pieces(
+        node_sets={
+            "a": tfgnn.NodeSet.from_fields(
+                sizes=tf.constant([2]),
+                features={_FEATURE_NAME: tf.constant([[1., 2.], [3., 4.]])}),
+            "b": tfgnn.NodeSet.from_fields(
+                sizes=tf.constant([2]),
+                features={_FEATURE_NAME: tf.constant([[0.], [0.]])})},
+        edge_sets={"x": edge_set([0, 1], [0, 1]),
+                   "y": edge_set([1], [0])})
+    conv = graph_sage.GCNGraphSAGENodeSetUpdate(
+        edge_set_names=["x", "y"],
+        receiver_tag=tfgnn.TARGET,
+        self_node_feature=_FEATURE_NAME,
+        sender_node_feature=_FEATURE_NAME,
+        reduce_type="sum",
+        units=1,
+        add_self_loop=False,
+        jit_compile=jit_compile)
+    _ = conv(graph, node_set_name="b")  # Build weights.
+    weights = {v.name: v for v in conv.trainable_weights}
+    self.assertLen(weights, 2)
+    weights["graph_sage_gcn_update/dense/kernel:0"].assign([[1.], [1.]])
+    weights["graph_sage_gcn_update/dense_1/kernel:0"].assign([[1.], [10.]])
+    actual = conv(graph, node_set_name="b")
+    # Node 0 gets 1+2 along "x" and 3+40 along "y", node 1 gets 3+4 along "x".
+    self.assertAllEqual([[46.], [7.]], actual[_FEATURE_NAME])
+
+  def testGatherWithDenseGradient(self):
+    params = tf.constant([[1., 2.], [3., 4.], [5., 6.]])
+    indices = tf.constant([2, 0, 2, 2])
+    upstream = tf.constant([[1., 0.], [0., 1.], [2., 0.], [0., 3.]])
+    with tf.GradientTape(persistent=True) as tape:
+      tape.watch(params)
+      expected = tf.gather(params, indices)
+      actual = graph_sage._gather_with_dense_gradient(params, indices)
+    self.assertAllEqual(expected, actual)
+    expected_grad = tape.gradient(expected, params, upstream)
+    actual_grad = tape.gradient(actual, params, upstream)
+    self.assertIsInstance(expected_grad, tf.IndexedSlices)
+    self.assertIsInstance(actual_grad, tf.Tensor)
+    self.assertAllEqual(tf.convert_to_tensor(expected_grad), actual_grad)
+
+  @parameterized.named_parameters(("Float", tf.float32, tf.int32),
+                                  ("Int64Ids", tf.float32, tf.int64))
+  def testSortedSegmentSum(self, dtype, ids_dtype):
+    data = tf.constant([[1., 2.], [3., 4.], [5., 6.], [7., 8.]], dtype)
+    segment_ids = tf.constant([3, 0, 3, 1], ids_dtype)
+    num_segments = tf.constant(5, ids_dtype)
+    self.assertAllEqual(
+        tf.math.unsorted_segment_sum(data, segment_ids, num_segments),
+        graph_sage._sorted_segment_sum(data, segment_ids, num_segments))
+
+  @parameterized.named_parameters(
+      ("Float32", tf.float32, 1e-6), ("Bfloat16", tf.bfloat16, 1e-2))
+  def testL2NormalizeRows(self, dtype, tolerance):
+    values = tf.constant([[3., 4.], [0., 0.], [-1., 1.]], dtype)
+    actual = graph_sage._l2_normalize_rows(values)
+    self.assertEqual(dtype, actual.dtype)
+    self.assertAllClose(
+        tf.math.l2_normalize(tf.cast(values, tf.float32), axis=1),
+        tf.cast(actual, tf.float32), rtol=tolerance, atol=tolerance)
 
   def testGCNConvolutionFail(self):
     graph = _get_test_graph()